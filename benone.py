@@ -5,12 +5,12 @@ import os
 import sys
 from pathlib import Path
 
-from flask import Flask, render_template, request
-from werkzeug.utils import secure_filename
-
-from src.analysis import DigitCounterAnalysis, WrongFile, Reader
-from src.config import AppConfig, DEF_CONFIG_FILENAME
-from src.database import Database
+from src.analysis import DigitCounterAnalysis, WindowCounters, WrongFile, WrongWindow, Reader
+from src.bulk import BulkAnalysis
+from src.config import AppConfig, DEF_CONFIG_FILENAME, WrongEnvironment
+from src.database import Database, AnalysisNotFound
+from src.responses import Compression, Layout, JSON_MIMETYPE
+from src.retention import Retention
 from src.utils import Term
 
 
@@ -18,22 +18,54 @@ class WrongRequest(Exception):
     pass
 
 
-class WrongEnvironment(Exception):
-    """Exception raised when wrong environment is set.
-
-    Attributes:
-        env -- input environment value which cased exception
-        message -- explanation of the error
-    """
+def add_api(app, database: Database, retention: Retention):
+    """Adds API for performing analyses and communication with database"""
+    # flask imported here, so headless bulk analysis does not need it
+    from flask import make_response, render_template, request
+    from werkzeug.utils import secure_filename
 
-    def __init__(self, env: str, message: str = 'Wrong environment, options = ["production", "development"]'):
-        self.env = env
-        self.message = message
-        super().__init__(self.message)
+    def analysis_response(analysis):
+        """Response with analysis stats and lead frequenters, in layout negotiated by `Accept` header.
 
+        Compact layouts contain lead frequenters only if `detail` query
+        argument is set, otherwise they can be fetched per column.
 
-def add_api(app, database: Database):
-    """Adds API for performing analyses and communication with database"""
+        """
+        mimetype = request.accept_mimetypes.best_match(Layout.get_supported_mimetypes()) or JSON_MIMETYPE
+        if not Layout.is_compact(mimetype):
+            response = make_response({
+                'success': True,
+                'stats': analysis.get_stats(),
+                'lead_frequenters': analysis.get_frequenters('lead'),
+            }, 200)
+        else:
+            data = {
+                'success': True,
+                # columns details are fetched by analysis id, which may differ from file hash
+                'id': analysis.id,
+                **Layout.columnar(analysis.get_stats(), analysis.get_frequenters('lead'),
+                                  detail='detail' in request.args),
+            }
+            response = app.response_class(Layout.serialize(data, mimetype), status=200, mimetype=mimetype)
+        # layout depends on `Accept` header, so caches must distinguish it
+        response.vary.add('Accept')
+        return response
+
+    @app.after_request
+    def compress_response(response):
+        """Compress API responses if client accepts it, brotli preferred over gzip."""
+        if response.mimetype not in Layout.get_supported_mimetypes() \
+                or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(Compression.get_supported_encodings())
+        body = response.get_data()
+        if Compression.should_compress(body, encoding):
+            response.set_data(Compression.compress(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+        return response
 
     @app.route('/', methods=['GET'])
     def index():
@@ -49,6 +81,14 @@ def add_api(app, database: Database):
             'files': database.get_filenames(),
         }
 
+    @app.route('/api/storage', methods=['GET'])
+    def storage_usage():
+        """Get users files storage usage and orphaned files and analyses."""
+        return {
+            'usage': retention.get_usage(),
+            'orphans': retention.get_orphans(),
+        }
+
     @app.route('/api/extensions', methods=['GET'])
     def extensions_list():
         """Get available extensions to use when parsing file."""
@@ -71,17 +111,101 @@ def add_api(app, database: Database):
             filename = secure_filename(filename)
             filename = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-            # analysis id is file hash, if done once, do not do it again
-            analysis_id = Reader.file_id(Path(filename), ext)
+            if not Path(filename).exists():
+                # file could be removed by retention, but its analysis is kept
+                analysis = database.get_removed_file_analysis(Path(filename).name, ext)
+            else:
+                # analysis id is file hash, if done once, do not do it again
+                analysis_id = Reader.file_id(Path(filename), ext)
+                database.touch_upload(filename)
+
+                # try to get analysis from database using file hash as id
+                if not (analysis := database.get_analysis(analysis_id)):
+                    analysis = DigitCounterAnalysis(filename, ext=ext)
+                    database.add_analysis(analysis)
+                database.link_upload(filename, analysis.id)
+        except WrongFile as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 400
+        except (KeyError, TypeError) as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 400
+        except Exception as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 400
+
+        return analysis_response(analysis)
+
+    @app.route('/api/column', methods=['POST'])
+    def column_details():
+        """Get Benford's Law details of single column from stored analysis.
+
+        Used with compact layouts, to fetch lead digits frequencies only
+        for selected column.
+
+        """
+        try:
+            data = request.get_json()
+            analysis_id = data['id']
+            column = data['column']
+            # aggregates are sent in compact layout too, so their columns are fetched here as well
+            if not (analysis := database.get_analysis_or_aggregate(analysis_id)):
+                raise AnalysisNotFound(analysis_id)
+            frequenter = analysis.get_frequenters('lead')[column]
+        except AnalysisNotFound as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 404
+        except (KeyError, TypeError) as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 400
+
+        return {
+                   'success': True,
+                   'column': column,
+                   'benford': analysis.get_stats()['benford'][column],
+                   'digits': list(Layout.lead_digits),
+                   'lead_frequencies': Layout.column_frequencies(frequenter),
+               }, 200
+
+    @app.route('/api/windows', methods=['POST'])
+    def analyze_windows():
+        """Find windows of rows in file which deviate the most from Benford's Law.
+
+        Windows are either `window_size` rows or rows grouped by value of
+        `window_column` (optionally only its `window_prefix` first letters).
+        Windowed analysis is stored in database like any other analysis.
+        Windows are scored by chi-square statistic against Benford's law,
+        only ones with at least `min_digits` lead digits in column.
+
+        """
+        try:
+            data = request.get_json()
+            ext = data['ext']
+            filename = data['filename']
+            filename = secure_filename(filename)
+            filename = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            window_size = int(data.get('window_size', 0))
+            window_column = data.get('window_column', '')
+            window_prefix = int(data.get('window_prefix', 0))
+            if not (window_size or window_column):
+                raise WrongWindow(window_size, window_column)
+
+            analysis_id = DigitCounterAnalysis.analysis_id(
+                Reader.file_id(Path(filename), ext), window_size, window_column, window_prefix
+            )
+            database.touch_upload(filename)
 
-            # try to get analysis from database using file hash as id
             if not (analysis := database.get_analysis(analysis_id)):
-                analysis = DigitCounterAnalysis(filename, ext=ext)
+                analysis = DigitCounterAnalysis(filename, ext=ext, window_size=window_size,
+                                                window_column=window_column, window_prefix=window_prefix)
                 database.add_analysis(analysis)
+
+            windows = analysis.get_windows().get_anomalous(int(data.get('count', 10)),
+                                                           int(data.get('min_digits', WindowCounters.min_digits)))
         except WrongFile as e:
             Term.error(str(e))
             return {'success': False, 'error': str(e)}, 400
-        except (KeyError, TypeError) as e:
+        except (KeyError, TypeError, ValueError) as e:
             Term.error(str(e))
             return {'success': False, 'error': str(e)}, 400
         except Exception as e:
@@ -91,9 +215,39 @@ def add_api(app, database: Database):
         return {
                    'success': True,
                    'stats': analysis.get_stats(),
-                   'lead_frequenters': analysis.get_frequenters('lead'),
+                   'windows': windows,
                }, 200
 
+    @app.route('/api/aggregate', methods=['POST'])
+    def aggregate_files():
+        """Aggregate Benford's Law analysis over many already analyzed files.
+
+        Analyses are selected by list of `ids` or by filename `pattern`
+        (optionally with `ext`), their counters are merged without
+        reading files again.
+
+        """
+        try:
+            data = request.get_json()
+            if 'ids' in data:
+                analysis_ids = data['ids']
+            else:
+                analyses = database.find_analyses(data['pattern'], data.get('ext', ''))
+                analysis_ids = [analysis.id for analysis in analyses]
+
+            aggregate = database.get_aggregate(analysis_ids)
+        except AnalysisNotFound as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 404
+        except (KeyError, TypeError) as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 400
+        except Exception as e:
+            Term.error(str(e))
+            return {'success': False, 'error': str(e)}, 400
+
+        return analysis_response(aggregate)
+
     @app.route('/api/upload', methods=['POST'])
     def get_user_file():
         """Get file from user.
@@ -118,6 +272,7 @@ def add_api(app, database: Database):
             # if file exists and content is same do not save again
             if (stored_file := Path(filename)).exists():
                 if Reader.same_files(stored_file, file):
+                    database.touch_upload(filename)
                     return {'success': True}, 200
                 # same filename but different content - not allowed, sorry
                 else:
@@ -128,7 +283,13 @@ def add_api(app, database: Database):
             return {'success': True}, 200
 
 
-def create_app(app_config: AppConfig = AppConfig(DEF_CONFIG_FILENAME)):
+def create_app(app_config: AppConfig = None):
+    from flask import Flask
+
+    # default config loaded only when needed, so other commands do not require it
+    if app_config is None:
+        app_config = AppConfig(DEF_CONFIG_FILENAME)
+
     app = Flask(__name__)
     if app_config.ENV == 'development':
         # refreshing application
@@ -152,7 +313,13 @@ def create_app(app_config: AppConfig = AppConfig(DEF_CONFIG_FILENAME)):
             'home': f'http://{app_config.HOST}:{app_config.PORT}',
         }
 
-    add_api(app, database)
+    # remove old files in background only if any quota set
+    retention = Retention(database, max_size=app_config.MAX_UPLOADS_SIZE, max_age=app_config.MAX_UPLOAD_AGE,
+                          interval=app_config.RETENTION_INTERVAL)
+    if app_config.MAX_UPLOADS_SIZE or app_config.MAX_UPLOAD_AGE:
+        retention.start()
+
+    add_api(app, database, retention)
 
     return app
 
@@ -160,6 +327,18 @@ def create_app(app_config: AppConfig = AppConfig(DEF_CONFIG_FILENAME)):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='BeNone is an Service for benning your data!')
     parser.add_argument('-c', '--config', type=str, default=DEF_CONFIG_FILENAME, help='config filename')
+    parser.add_argument('--asgi', action='store_true', help='serve async ASGI application, requires uvicorn')
+    parser.add_argument('--workers', type=int, default=None, help='number of analyses processes in ASGI mode')
+    subparsers = parser.add_subparsers(dest='command', help='without command, server is started')
+
+    bulk_parser = subparsers.add_parser('bulk', help='analyze files without starting server')
+    bulk_parser.add_argument('paths', type=str, nargs='+', help='directories or glob patterns of files')
+    bulk_parser.add_argument('-o', '--output', type=str, default='bulk_output', help='output directory')
+    bulk_parser.add_argument('-f', '--format', type=str, default='json', choices=BulkAnalysis.supported_formats,
+                             help='summaries format')
+    bulk_parser.add_argument('-e', '--ext', type=str, default='', choices=['', *Reader.get_supported_extensions()],
+                             help='file format, if not provided, recognized by extension')
+    bulk_parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
 
     args = parser.parse_args()
     try:
@@ -168,5 +347,20 @@ if __name__ == '__main__':
         Term.error(f'Invalid configuration file = {args.config}')
         sys.exit(1)
 
+    if args.command == 'bulk':
+        main_database = Database('data/users.pickle', 'data/analyses.pickle', main_app_config.UPLOAD_FOLDER)
+        bulk = BulkAnalysis(main_database, args.output, fmt=args.format, ext=args.ext, workers=args.jobs)
+        bulk_report = bulk.run(args.paths)
+        # batch jobs should notice that some files failed
+        sys.exit(1 if bulk_report['errors'] else 0)
+
+    if args.asgi:
+        import uvicorn
+        from src.asgi import create_asgi_app
+
+        uvicorn.run(create_asgi_app(main_app_config, args.workers),
+                    host=main_app_config.HOST, port=main_app_config.PORT)
+        sys.exit(0)
+
     bpp = create_app(main_app_config)
     bpp.run(main_app_config.HOST, main_app_config.PORT)
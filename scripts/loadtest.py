@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Local load test of BeNone server, with mix of concurrent uploads and listing requests.
+
+Works against both serving modes, e.g.:
+
+    ./benone.py -c cfg.json --asgi
+    ./scripts/loadtest.py --url http://127.0.0.1:5000 --uploads 50 --listings 500 --analyze
+
+Uploaded files are named `loadtest-*.csv` and left in UPLOAD_FOLDER.
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+
+def random_csv(rows: int, columns: int) -> bytes:
+    """CSV with random numbers, roughly following Benford's law"""
+    header = ','.join(f'col_{i}' for i in range(columns))
+    lines = [
+        ','.join(str(int(10 ** random.uniform(0, 6))) for _ in range(columns))
+        for _ in range(rows)
+    ]
+    return '\n'.join([header, *lines]).encode()
+
+
+def multipart(filename: str, content: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: text/csv\r\n\r\n',
+        content,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def timed_request(request: Request) -> Tuple[float, bool]:
+    """Send request, return latency in seconds and success"""
+    start = time.perf_counter()
+    try:
+        with urlopen(request, timeout=300) as response:
+            response.read()
+            ok = True
+    except (HTTPError, URLError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def upload(url: str, rows: int, columns: int, analyze: bool) -> List[Tuple[str, float, bool]]:
+    filename = f'loadtest-{uuid.uuid4().hex}.csv'
+    body, content_type = multipart(filename, random_csv(rows, columns))
+    results = [('upload', *timed_request(Request(f'{url}/api/upload', data=body,
+                                                 headers={'Content-Type': content_type})))]
+    if analyze and results[0][2]:
+        data = json.dumps({'filename': filename, 'ext': '.csv'}).encode()
+        results.append(('analyze', *timed_request(Request(f'{url}/api/analyze', data=data,
+                                                          headers={'Content-Type': 'application/json'}))))
+    return results
+
+
+def listing(url: str, endpoint: str) -> List[Tuple[str, float, bool]]:
+    return [(endpoint, *timed_request(Request(f'{url}/api/{endpoint}')))]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(results: List[Tuple[str, float, bool]], elapsed: float) -> Dict[str, Dict[str, float]]:
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for endpoint, latency, ok in results:
+        latencies[endpoint].append(latency)
+        errors[endpoint] += not ok
+
+    print(f'{"endpoint":<12}{"count":>8}{"errors":>8}{"p50 [ms]":>12}{"p99 [ms]":>12}{"max [ms]":>12}')
+    summary = {}
+    for endpoint, values in sorted(latencies.items()):
+        summary[endpoint] = {
+            'count': len(values),
+            'errors': errors[endpoint],
+            'p50': percentile(values, 50) * 1000,
+            'p99': percentile(values, 99) * 1000,
+            'max': max(values) * 1000,
+        }
+        s = summary[endpoint]
+        print(f'{endpoint:<12}{s["count"]:>8}{s["errors"]:>8}{s["p50"]:>12.1f}{s["p99"]:>12.1f}{s["max"]:>12.1f}')
+    print(f'total {len(results)} requests in {elapsed:.1f}s')
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test BeNone server with uploads and listings')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:5000', help='server address')
+    parser.add_argument('--uploads', type=int, default=20, help='number of uploaded files')
+    parser.add_argument('--listings', type=int, default=200, help='number of listing requests')
+    parser.add_argument('--rows', type=int, default=20000, help='rows in each uploaded file')
+    parser.add_argument('--columns', type=int, default=10, help='columns in each uploaded file')
+    parser.add_argument('--analyze', action='store_true', help='analyze each file after upload')
+    parser.add_argument('--concurrency', type=int, default=32, help='number of concurrent clients')
+    parser.add_argument('--output', type=str, default='', help='optional JSON file for summary')
+
+    args = parser.parse_args()
+
+    # mix uploads and listings randomly, so they are sent concurrently
+    tasks = [('upload', None)] * args.uploads + [
+        ('listing', random.choice(['files', 'extensions'])) for _ in range(args.listings)
+    ]
+    random.shuffle(tasks)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(upload, args.url, args.rows, args.columns, args.analyze)
+            if task == 'upload'
+            else pool.submit(listing, args.url, endpoint)
+            for task, endpoint in tasks
+        ]
+        all_results = [result for future in futures for result in future.result()]
+
+    main_summary = report(all_results, time.perf_counter() - start)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(main_summary, f, indent=2)
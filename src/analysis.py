@@ -1,8 +1,11 @@
-from collections import Counter
+import codecs
+import csv
+from array import array
+from collections import Counter, defaultdict
 from hashlib import sha256
 from pathlib import Path
 from string import digits
-from typing import Dict, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 
 class WrongFile(Exception):
@@ -10,15 +13,22 @@ class WrongFile(Exception):
 
     def __init__(self, path: str, cause: str):
         self.path = path
+        self.cause = cause
         if cause == 'not-exists':
             self.message = f'File {path} does not exist'
         elif cause == 'corrupted':
             self.message = f'File {path} is corrupted'
+        elif cause == 'empty':
+            self.message = f'File {path} is empty'
         else:
             self.message = f'File {path} is invalid'
 
         super().__init__(self.message)
 
+    def __reduce__(self):
+        # raised in worker processes too, so must be unpickled from constructor arguments
+        return WrongFile, (self.path, self.cause)
+
 
 class WrongLetter(Exception):
     """Exception raised when user tries to reference not digit in counter."""
@@ -32,9 +42,13 @@ class WrongColumn(Exception):
     """Exception raised when user tries to reference to column not in counters dict."""
 
     def __init__(self, column: str):
+        self.column = column
         self.message = f'Wrong column = {column}, not exits in counters dictionary'
         super().__init__(self.message)
 
+    def __reduce__(self):
+        return WrongColumn, (self.column,)
+
 
 class WrongCountersType(Exception):
     """Exception raised when trying to get counters of wrong type than allowed."""
@@ -44,9 +58,37 @@ class WrongCountersType(Exception):
         super().__init__(self.message)
 
 
+class EmptyAggregate(Exception):
+    """Exception raised when trying to aggregate empty set of analyses."""
+
+    def __init__(self):
+        self.message = 'Cannot aggregate empty set of analyses'
+        super().__init__(self.message)
+
+
+class WrongWindow(Exception):
+    """Exception raised when windows parameters are invalid."""
+
+    def __init__(self, size: int, column: str):
+        self.size = size
+        self.column = column
+        self.message = f'Wrong window, size = {size}, column = {column}, ' \
+                       f'exactly one of positive size or column allowed'
+        super().__init__(self.message)
+
+    def __reduce__(self):
+        return WrongWindow, (self.size, self.column)
+
+
 class Reader:
     """Class for reading from file.
 
+    Before reading, first bytes of file are sniffed to detect encoding,
+    delimiter, quote character and line with header. Only leading lines
+    which can not be header (single field or fewer fields than next line)
+    are skipped as preamble. Delimiter of file format is preferred,
+    if it fits the data as well as any other.
+
     Args:
         filename (str): path to file to analyze, stored locally
         ext (str): file format, if empty, try recognizing
@@ -58,6 +100,12 @@ class Reader:
         '.csv': ',',
     }
 
+    # delimiters which may be detected, besides supported extensions ones
+    sniffed_delimiters = [',', '\t', ';', '|']
+
+    # size of file beginning used for sniffing
+    sniff_size = 16 * 1024
+
     def __init__(self, filename: str, ext: str = ''):
         self.file = Path(filename)
         if not self.file.exists():
@@ -73,7 +121,8 @@ class Reader:
             else:
                 self.ext = ''  # extension should be empty if not recognized
 
-        self.delim = Reader.supported_extensions.get(self.ext, ',')
+        self.sniff = Reader.sniff_file(self.file, Reader.supported_extensions.get(self.ext, ','))
+        self.delim = self.sniff['delimiter']
 
         # add extension which were used to parse to id for making distinctions
         self.id = Reader.file_id(self.file, self.ext)
@@ -87,11 +136,94 @@ class Reader:
         yield from self.read_csv(self.file)
 
     def read_csv(self, file: Path):
-        import csv
-        with file.open('r', newline='') as csv_file:
-            reader = csv.reader(csv_file, delimiter=self.delim)
+        # undecodable bytes are replaced, they can not be digits anyway
+        with file.open('r', newline='', encoding=self.sniff['encoding'], errors='replace') as csv_file:
+            reader = csv.reader(csv_file, delimiter=self.delim, quotechar=self.sniff['quotechar'])
+            # skip preamble before header
+            for _ in range(self.sniff['header_line']):
+                next(reader, None)
             yield from reader
 
+    @staticmethod
+    def sniff_file(file: Path, delim: str) -> Dict[str, Union[str, int]]:
+        """Detect encoding, delimiter, quote character and header line from beginning of file"""
+        with file.open('rb') as f:
+            sample = f.read(Reader.sniff_size)
+        encoding = Reader.sniff_encoding(sample)
+
+        # decode without last, possibly incomplete line
+        text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample)
+        lines = text.splitlines()
+        if len(sample) == Reader.sniff_size and len(lines) > 1:
+            lines = lines[:-1]
+
+        # pick delimiter splitting the most of lines into the same number (> 1) of fields,
+        # file format delimiter is first, so it is kept on ties
+        best = (0, delim, 1)
+        for candidate in dict.fromkeys([delim, *Reader.sniffed_delimiters]):
+            fields = [len(line) for line in csv.reader(lines, delimiter=candidate)]
+            if not fields:
+                continue
+            size = Counter(fields).most_common(1)[0][0]
+            if size > 1 and (matching := fields.count(size)) > best[0]:
+                best = (matching, candidate, size)
+        _, delim, size = best
+
+        quotechar = Reader.sniff_quotechar('\n'.join(lines), delim)
+
+        header_line = 0
+        if size > 1:
+            fields = [Reader.fields_count(line) for line in csv.reader(lines, delimiter=delim, quotechar=quotechar)]
+            size = Counter(fields).most_common(1)[0][0]
+            # only lines which can not be header are skipped as preamble, i.e. with at most one field
+            # or fewer fields than next line, data rows may be ragged, so header is not searched by their size
+            for i, line_size in enumerate(fields[:-1]):
+                if line_size >= size or (line_size > 1 and line_size >= fields[i + 1]):
+                    break
+                header_line = i + 1
+
+        return {
+            'encoding': encoding,
+            'delimiter': delim,
+            'quotechar': quotechar,
+            'header_line': header_line,
+        }
+
+    @staticmethod
+    def fields_count(line: List[str]) -> int:
+        """Number of fields in line, without trailing empty ones left by trailing delimiters"""
+        count = len(line)
+        while count and not line[count - 1]:
+            count -= 1
+        return count
+
+    @staticmethod
+    def sniff_encoding(sample: bytes) -> str:
+        """Detect encoding by BOM, then try utf-8, fall back to cp1252 or latin-1"""
+        if sample.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if sample.startswith((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)):
+            return 'utf-32'
+        if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16'
+        # sample cut from longer file may end in the middle of multi-byte character
+        final = len(sample) < Reader.sniff_size
+        for encoding in ('utf-8', 'cp1252'):
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        return 'latin-1'
+
+    @staticmethod
+    def sniff_quotechar(text: str, delim: str) -> str:
+        """Detect quote character, double quote if not found"""
+        try:
+            return csv.Sniffer().sniff(text, delimiters=delim).quotechar or '"'
+        except csv.Error:
+            return '"'
+
     @staticmethod
     def get_head(reader: 'Reader', count: int = 5) -> str:
         """Get head of file as max count first lines"""
@@ -143,22 +275,50 @@ class DigitCounterAnalysis:
         filename (str): path to file to analyze, stored locally
         ext (str): file format
 
+        window_size (int): if positive, count lead digits also per windows of that many rows
+        window_column (str): if provided, count lead digits also per windows by value of that column
+        window_prefix (int): if positive, only that many first letters of `window_column`
+            value are used as window, e.g. 7 for grouping `YYYY-MM-DD` dates by months
+        recover (bool): if True, lines with wrong number of fields are counted
+            by columns positions instead of being omitted
+
     Attributes:
         filename (str): path to file to analyze, stored locally
     """
 
-    def __init__(self, filename: str, /, *, ext: str = ''):
+    # benford's law digits distribution
+    benford_frequencies = {
+        '1': 30.1,
+        '2': 17.6,
+        '3': 12.5,
+        '4': 9.7,
+        '5': 7.9,
+        '6': 6.7,
+        '7': 5.8,
+        '8': 5.1,
+        '9': 4.6,
+    }
+
+    def __init__(self, filename: str, /, *, ext: str = '',
+                 window_size: int = 0, window_column: str = '', window_prefix: int = 0, recover: bool = True):
         reader = Reader(filename, ext)
 
         # get head of file to show it to user
         self._head = Reader.get_head(reader)
 
+        # lead digits counters per windows are collected in the same pass over file
+        if window_size or window_column:
+            self._windows = WindowCounters(window_size, window_column, window_prefix)
+        else:
+            self._windows = None
+
         # get letters counters, lead letters counters and stats
-        counters, lead_counters, stats = DigitCounterAnalysis.analyze_file(reader)
+        counters, lead_counters, stats = DigitCounterAnalysis.analyze_file(reader, self._windows, recover)
 
         self._stats = stats
-        # set analysis id as file hash
-        self.id = stats['hash']
+        # set analysis id as file hash, windowed and strict analyses are stored separately
+        self.id = DigitCounterAnalysis.analysis_id(stats['hash'], window_size, window_column, window_prefix,
+                                                   recover)
 
         def to_digit_counters(sel_counters):
             """Convert counters to digit only counters"""
@@ -190,6 +350,11 @@ class DigitCounterAnalysis:
     def get_head(self) -> str:
         return self._head
 
+    def get_windows(self) -> Optional['WindowCounters']:
+        """Get lead digits counters per windows, None if analysis was not windowed"""
+        # analyses stored before windows were introduced do not have them
+        return getattr(self, '_windows', None)
+
     def get_count(self, letter: Union[str, int], column: str = '') -> int:
         """Get letter count for specific column, or if column name not provided - whole file"""
         counter = self.get_counter(column)
@@ -233,6 +398,22 @@ class DigitCounterAnalysis:
         else:
             raise WrongCountersType
 
+    @staticmethod
+    def analysis_id(file_id: str, window_size: int = 0, window_column: str = '', window_prefix: int = 0,
+                    recover: bool = True) -> str:
+        """Analysis id is file id, with windows parameters if analysis is windowed
+        and with `:strict` suffix if lines with wrong number of fields were omitted"""
+        if window_size and window_column:
+            raise WrongWindow(window_size, window_column)
+        analysis_id = file_id
+        if window_size:
+            analysis_id = f'{analysis_id}:rows={window_size}'
+        elif window_column:
+            analysis_id = f'{analysis_id}:column={window_column}:{window_prefix}'
+        if not recover:
+            analysis_id = f'{analysis_id}:strict'
+        return analysis_id
+
     @staticmethod
     def benfords_law(frequenter: Dict[str, float]):
         """Use Two-sample Kolmogorov-Smirnov test to calculate p-values for Benford's law
@@ -247,18 +428,7 @@ class DigitCounterAnalysis:
         """
         from scipy.stats import ks_2samp
 
-        # benford's law digits distribution
-        bl_frequencies = {
-            '1': 30.1,
-            '2': 17.6,
-            '3': 12.5,
-            '4': 9.7,
-            '5': 7.9,
-            '6': 6.7,
-            '7': 5.8,
-            '8': 5.1,
-            '9': 4.6,
-        }
+        bl_frequencies = DigitCounterAnalysis.benford_frequencies
         bl_f = []
         sa_f = []
         for digit in bl_frequencies:
@@ -306,7 +476,7 @@ class DigitCounterAnalysis:
         })
 
     @staticmethod
-    def analyze_file(reader: Reader) -> (
+    def analyze_file(reader: Reader, windows: Optional['WindowCounters'] = None, recover: bool = True) -> (
             Dict[str, Counter],
             Dict[str, Union[str, int]]):
         """Analyzing file in terms of letters usage.
@@ -318,6 +488,11 @@ class DigitCounterAnalysis:
 
         Args:
             reader (Reader): file Reader object
+            windows (WindowCounters): if provided, lead digits are
+                also counted per windows of rows
+            recover (bool): if True, non empty lines with wrong number of
+                fields are counted by columns positions, missing fields are
+                skipped and extra fields are dropped
 
         Returns:
             1st: dictionary of counters, where keys are columns names
@@ -330,16 +505,21 @@ class DigitCounterAnalysis:
         reader_it = iter(reader)
 
         # get file header
-        header = next(reader_it)
+        if (header := next(reader_it, None)) is None:
+            raise WrongFile(str(reader.file), 'empty')
 
         # create counter for each column in header
         header_len = len(header)
         counters = [Counter() for _ in header]
         lead_counters = [Counter() for _ in header]
 
+        if windows is not None:
+            windows.set_header(header)
+
         # iterate over each line, and each element in line
-        # count omitted lines
+        # count omitted and recovered lines
         omitted_lines = 0
+        recovered_lines = 0
         parsed_lines = 0
         parsed_words = 0
         for line in reader_it:
@@ -348,8 +528,14 @@ class DigitCounterAnalysis:
                 # we can enforce only proper files
                 # but we may also handle this
                 # raise WrongFile(filename, 'corrupted')
-                omitted_lines += 1
-                continue
+                if not recover or not line:
+                    omitted_lines += 1
+                    continue
+                # salvage fields by their positions
+                recovered_lines += 1
+                line = line[:header_len]
+            if windows is not None:
+                windows.count(parsed_lines - 1, line)
             for i, elem in enumerate(line):
                 parsed_words += 1
                 # count leading letters only if len(elem) > 0
@@ -373,7 +559,240 @@ class DigitCounterAnalysis:
             'header_size': header_len,
             'parsed_lines': parsed_lines,
             'omitted_lines': omitted_lines,
+            'recovered_lines': recovered_lines,
             'parsed_words': parsed_words,
             'hash': reader.id,
+            'sniff': reader.sniff,
         }
+        if windows is not None:
+            stats['windows'] = len(windows)
         return counters, lead_counters, stats
+
+
+class WindowCounters:
+    """Class for counting lead digits per windows of rows, to localize anomalies within file.
+
+    Windows are either fixed size ranges of data rows, or groups of rows with the
+    same value (or value prefix) in selected column, e.g. date. For each window,
+    lead digits 1-9 are counted per column in single flat array, so memory is
+    bounded by number of windows * number of columns * 9 counts.
+
+    Args:
+        size (int): if positive, number of data rows in each window
+        column (str): if provided, column which value is used as window
+        prefix (int): if positive, only that many first letters of column value are used
+
+    Attributes:
+        columns (List[str]): columns names, set from file header
+    """
+
+    lead_digits = digits[1:]
+
+    # chi-square test needs at least 5 expected counts of each digit, 9 is expected in 4.6% of numbers
+    min_digits = 110
+
+    def __init__(self, size: int = 0, column: str = '', prefix: int = 0):
+        if (size > 0) == bool(column) or size < 0:
+            raise WrongWindow(size, column)
+
+        self.size = size
+        self.column = column
+        self.prefix = prefix
+        self.columns = []
+
+        self._column_idx = -1
+        self._windows = {}
+
+    def __len__(self):
+        return len(self._windows)
+
+    def set_header(self, header: List[str]):
+        """Set columns names, must be done before counting"""
+        if self.column:
+            if self.column not in header:
+                raise WrongColumn(self.column)
+            self._column_idx = header.index(self.column)
+        self.columns = list(header)
+
+    def count(self, row: int, line: List[str]):
+        """Count lead digits from data line with index `row` into its window"""
+        if self.size:
+            key = row // self.size
+        elif self._column_idx >= len(line):
+            # recovered line without window column can not be assigned to any window
+            return
+        else:
+            key = line[self._column_idx]
+            if self.prefix:
+                key = key[:self.prefix]
+
+        if (window := self._windows.get(key)) is None:
+            window = self._windows[key] = array('L', [0]) * (9 * len(self.columns))
+
+        for i, elem in enumerate(line):
+            # only digits 1-9 can be lead digits for Benford's law
+            if elem and '1' <= elem[0] <= '9':
+                window[i * 9 + ord(elem[0]) - 49] += 1
+
+    def get_window_name(self, key: Union[int, str]) -> str:
+        """Human readable window name, rows range (0-based, data rows only) or column value"""
+        if self.size:
+            return f'rows {key * self.size}-{(key + 1) * self.size - 1}'
+        return str(key)
+
+    def get_counters(self, key: Union[int, str]) -> Dict[str, Counter]:
+        """Get lead digits counters per column in window"""
+        window = self._windows[key]
+        return {
+            column: Counter(dict(zip(WindowCounters.lead_digits, window[i * 9:(i + 1) * 9])))
+            for i, column in enumerate(self.columns)
+        }
+
+    def get_scores(self, min_digits: int = min_digits) -> List[Dict[str, Union[str, int, float]]]:
+        """Get chi-square scores for each window and column with at least `min_digits` lead digits"""
+        from scipy.stats import chi2
+
+        scores = []
+        for key, window in self._windows.items():
+            for i, column in enumerate(self.columns):
+                if column == self.column:
+                    continue
+                counts = window[i * 9:(i + 1) * 9]
+                if (total := sum(counts)) < max(min_digits, 1):
+                    continue
+                score = WindowCounters.chi_square(counts, total)
+                scores.append({
+                    'window': self.get_window_name(key),
+                    'column': column,
+                    'digits': total,
+                    'score': score,
+                    'pvalue': round(chi2.sf(score, 8), 4),
+                })
+        return scores
+
+    def get_anomalous(self, count: int = 10, min_digits: int = min_digits) -> List[Dict[str, Union[str, int, float]]]:
+        """Get `count` windows and columns which deviate the most from Benford's law"""
+        scores = self.get_scores(min_digits)
+        scores.sort(key=lambda score: score['score'], reverse=True)
+        return scores[:count]
+
+    @staticmethod
+    def chi_square(counts: array, total: int) -> float:
+        """Chi-square statistic of lead digits counts against Benford's law.
+
+        In contrast to differences of frequencies, it grows with number of
+        digits, so small windows deviating by chance are not scored higher
+        than big ones deviating consistently.
+        """
+        bl_frequencies = DigitCounterAnalysis.benford_frequencies
+        chi_sq = 0.0
+        for digit, count in zip(WindowCounters.lead_digits, counts):
+            expected = total * bl_frequencies[digit] / 100.0
+            chi_sq += (count - expected) ** 2 / expected
+        return round(chi_sq, 4)
+
+
+class AggregateAnalysis:
+    """Class for merging stored analyses into one, without reading files again.
+
+    Digits counters can be summed, so per column counters from each analysis
+    are merged and Benford's law statistics are calculated on the result.
+    Columns with the same name in different files are treated as one column.
+
+    Args:
+        analyses (List[DigitCounterAnalysis]): analyses to aggregate
+
+    Attributes:
+        ids (Tuple[str]): sorted ids of aggregated analyses
+        id (str): aggregate id, based on aggregated analyses ids
+    """
+
+    def __init__(self, analyses: List[DigitCounterAnalysis]):
+        if not analyses:
+            raise EmptyAggregate
+
+        # same analysis aggregated twice would count its digits twice
+        analyses = list({analysis.id: analysis for analysis in analyses}.values())
+
+        self.ids = AggregateAnalysis.aggregate_key(analysis.id for analysis in analyses)
+        self.id = sha256('\n'.join(self.ids).encode()).hexdigest()
+
+        # merge counters per column from all analyses
+        self._digit_counters = AggregateAnalysis.merge_counters(
+            [analysis.get_counters('simple') for analysis in analyses]
+        )
+        self._digit_lead_counters = AggregateAnalysis.merge_counters(
+            [analysis.get_counters('lead') for analysis in analyses]
+        )
+
+        # counters converted to frequenters
+        self._digit_frequenters = DigitCounterAnalysis.to_frequenters(self._digit_counters)
+        self._digit_lead_frequenters = DigitCounterAnalysis.to_frequenters(self._digit_lead_counters)
+
+        # merge all counters for all files analysis
+        self._merged_digit_counter = DigitCounterAnalysis.get_merged_digit_counter(self._digit_counters)
+        self._merged_digit_lead_counter = DigitCounterAnalysis.get_merged_digit_counter(self._digit_lead_counters)
+
+        stats = [analysis.get_stats() for analysis in analyses]
+        self._stats = {
+            'filenames': [stat['filename'] for stat in stats],
+            'files': len(stats),
+            'parsed_lines': sum(stat['parsed_lines'] for stat in stats),
+            'omitted_lines': sum(stat['omitted_lines'] for stat in stats),
+            'recovered_lines': sum(stat.get('recovered_lines', 0) for stat in stats),
+            'parsed_words': sum(stat['parsed_words'] for stat in stats),
+            'hashes': list(self.ids),
+            'hash': self.id,
+            'benford': {
+                column: DigitCounterAnalysis.benfords_law(frequenter)
+                for column, frequenter in self._digit_lead_frequenters.items()
+            },
+        }
+
+    def get_stats(self) -> Dict[str, Union[str, int]]:
+        return self._stats
+
+    def get_counter(self, column: str = '') -> Counter:
+        """Get counter for specific column, or if column name not provided - all files"""
+        if not column:
+            return self._merged_digit_counter
+        if column not in self._digit_counters:
+            raise WrongColumn(column)
+        return self._digit_counters[column]
+
+    def get_counters(self, c_type: str) -> Dict[str, Counter]:
+        """Get all counters per column, counter types = ['lead', 'simple']"""
+        if c_type == 'simple':
+            return self._digit_counters
+        elif c_type == 'lead':
+            return self._digit_lead_counters
+        else:
+            raise WrongCountersType(c_type)
+
+    def get_frequenters(self, c_type: str) -> Dict[str, Dict[str, float]]:
+        """Get all frequenters per column, counter types = ['lead', 'simple']"""
+        if c_type == 'simple':
+            return self._digit_frequenters
+        elif c_type == 'lead':
+            return self._digit_lead_frequenters
+        else:
+            raise WrongCountersType(c_type)
+
+    @staticmethod
+    def aggregate_key(analysis_ids: Iterable[str]) -> Tuple[str, ...]:
+        """Key identifying aggregate, same for any order or duplicates of ids"""
+        return tuple(sorted(set(analysis_ids)))
+
+    @staticmethod
+    def merge_counters(counters_list: List[Dict[str, Counter]]) -> Dict[str, Counter]:
+        """Merge per column counters from many analyses into one per column counters"""
+        merged = defaultdict(Counter)
+        for counters in counters_list:
+            for column, counter in counters.items():
+                # update keeps zero counts, in contrast to adding counters
+                merged[column].update(counter)
+
+        return {
+            column: DigitCounterAnalysis.to_digit_counter(counter)
+            for column, counter in merged.items()
+        }
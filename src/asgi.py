@@ -0,0 +1,302 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from hashlib import sha256
+from pathlib import Path
+
+import anyio
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+from werkzeug.utils import secure_filename
+
+from src.analysis import DigitCounterAnalysis, Reader, WindowCounters, WrongWindow
+from src.config import AppConfig, WrongEnvironment
+from src.database import AnalysisExists, AnalysisNotFound, Database
+from src.responses import Layout, JSON_MIMETYPE, MIN_COMPRESS_SIZE
+from src.retention import Retention
+from src.utils import Term
+
+# size of chunks in which uploaded files are read and written
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def error_response(e: Exception, status: int = 400) -> JSONResponse:
+    Term.error(str(e))
+    return JSONResponse({'success': False, 'error': str(e)}, status_code=status)
+
+
+def best_mimetype(request: Request) -> str:
+    """Pick response layout by `Accept` header, same as in Flask mode"""
+    from werkzeug.datastructures import MIMEAccept
+    from werkzeug.http import parse_accept_header
+
+    accept = parse_accept_header(request.headers.get('accept', ''), MIMEAccept)
+    return accept.best_match(Layout.get_supported_mimetypes()) or JSON_MIMETYPE
+
+
+def analysis_response(request: Request, analysis) -> Response:
+    """Response with analysis stats and lead frequenters, in layout negotiated by `Accept` header"""
+    mimetype = best_mimetype(request)
+    if not Layout.is_compact(mimetype):
+        # layout depends on `Accept` header, so caches must distinguish it
+        return JSONResponse({
+            'success': True,
+            'stats': analysis.get_stats(),
+            'lead_frequenters': analysis.get_frequenters('lead'),
+        }, headers={'Vary': 'Accept'})
+
+    data = {
+        'success': True,
+        # columns details are fetched by analysis id, which may differ from file hash
+        'id': analysis.id,
+        **Layout.columnar(analysis.get_stats(), analysis.get_frequenters('lead'),
+                          detail='detail' in request.query_params),
+    }
+    return Response(Layout.serialize(data, mimetype), media_type=mimetype, headers={'Vary': 'Accept'})
+
+
+def add_api(app_config: AppConfig, database: Database, retention: Retention, pool: ProcessPoolExecutor) -> list:
+    """Adds async API for performing analyses and communication with database.
+
+    Lightweight endpoints are synchronous, so they are run in threads pool
+    and never wait behind uploads or analyses. Files are read and written
+    in chunks without blocking event loop, analyses are performed in
+    processes pool.
+    """
+    templates = Jinja2Templates(directory='templates')
+    # templates are shared with Flask mode, which uses `url_for(endpoint, filename=...)`
+    templates.env.globals['url_for'] = lambda endpoint, filename: f'/{endpoint}/{filename}'
+
+    def upload_path(filename: str) -> str:
+        return os.path.join(app_config.UPLOAD_FOLDER, secure_filename(filename))
+
+    async def get_or_analyze(analysis_id: str, filename: str, **kwargs) -> DigitCounterAnalysis:
+        """Get analysis from database, or analyze file in processes pool and store it"""
+        if analysis := database.get_analysis(analysis_id):
+            return analysis
+
+        analysis = await asyncio.wrap_future(pool.submit(partial(DigitCounterAnalysis, filename, **kwargs)))
+        try:
+            await run_in_threadpool(database.add_analysis, analysis)
+        except AnalysisExists:
+            # same file analyzed concurrently by other request
+            analysis = database.get_analysis(analysis.id)
+        return analysis
+
+    def index(request: Request):
+        return templates.TemplateResponse(request, 'index.html', {
+            'help': database.get_app_help(),
+            'home': f'http://{app_config.HOST}:{app_config.PORT}',
+        })
+
+    def files_list(request: Request):
+        """Get available files uploaded by users."""
+        return JSONResponse({
+            'files': database.get_filenames(),
+        })
+
+    def storage_usage(request: Request):
+        """Get users files storage usage and orphaned files and analyses."""
+        return JSONResponse({
+            'usage': retention.get_usage(),
+            'orphans': retention.get_orphans(),
+        })
+
+    def extensions_list(request: Request):
+        """Get available extensions to use when parsing file."""
+        return JSONResponse({
+            'extensions': Reader.get_supported_extensions(),
+        })
+
+    async def analyze_file(request: Request):
+        """Analyze file for Benford's Law, same as in Flask mode."""
+        try:
+            data = await request.json()
+            ext = data['ext']
+            filename = upload_path(data['filename'])
+
+            if not Path(filename).exists():
+                # file could be removed by retention, but its analysis is kept
+                analysis = database.get_removed_file_analysis(Path(filename).name, ext)
+            else:
+                # hashing reads whole file, so do it outside event loop
+                analysis_id = await run_in_threadpool(Reader.file_id, Path(filename), ext)
+                database.touch_upload(filename)
+                analysis = await get_or_analyze(analysis_id, filename, ext=ext)
+                await run_in_threadpool(database.link_upload, filename, analysis.id)
+        except Exception as e:
+            return error_response(e)
+
+        return analysis_response(request, analysis)
+
+    async def column_details(request: Request):
+        """Get Benford's Law details of single column from stored analysis."""
+        try:
+            data = await request.json()
+            analysis_id = data['id']
+            column = data['column']
+            # aggregates are sent in compact layout too, so their columns are fetched here as well
+            if not (analysis := database.get_analysis_or_aggregate(analysis_id)):
+                raise AnalysisNotFound(analysis_id)
+            frequenter = analysis.get_frequenters('lead')[column]
+        except AnalysisNotFound as e:
+            return error_response(e, 404)
+        except (KeyError, TypeError, ValueError) as e:
+            return error_response(e)
+
+        return JSONResponse({
+            'success': True,
+            'column': column,
+            'benford': analysis.get_stats()['benford'][column],
+            'digits': list(Layout.lead_digits),
+            'lead_frequencies': Layout.column_frequencies(frequenter),
+        })
+
+    async def analyze_windows(request: Request):
+        """Find windows of rows in file which deviate the most from Benford's Law."""
+        try:
+            data = await request.json()
+            ext = data['ext']
+            filename = upload_path(data['filename'])
+            window_size = int(data.get('window_size', 0))
+            window_column = data.get('window_column', '')
+            window_prefix = int(data.get('window_prefix', 0))
+            if not (window_size or window_column):
+                raise WrongWindow(window_size, window_column)
+
+            file_id = await run_in_threadpool(Reader.file_id, Path(filename), ext)
+            analysis_id = DigitCounterAnalysis.analysis_id(file_id, window_size, window_column, window_prefix)
+            database.touch_upload(filename)
+            analysis = await get_or_analyze(analysis_id, filename, ext=ext, window_size=window_size,
+                                            window_column=window_column, window_prefix=window_prefix)
+
+            windows = analysis.get_windows().get_anomalous(int(data.get('count', 10)),
+                                                           int(data.get('min_digits', WindowCounters.min_digits)))
+        except Exception as e:
+            return error_response(e)
+
+        return JSONResponse({
+            'success': True,
+            'stats': analysis.get_stats(),
+            'windows': windows,
+        })
+
+    async def aggregate_files(request: Request):
+        """Aggregate Benford's Law analysis over many already analyzed files."""
+        try:
+            data = await request.json()
+            if 'ids' in data:
+                analysis_ids = data['ids']
+            else:
+                analyses = database.find_analyses(data['pattern'], data.get('ext', ''))
+                analysis_ids = [analysis.id for analysis in analyses]
+
+            aggregate = await run_in_threadpool(database.get_aggregate, analysis_ids)
+        except AnalysisNotFound as e:
+            return error_response(e, 404)
+        except Exception as e:
+            return error_response(e)
+
+        return analysis_response(request, aggregate)
+
+    async def get_user_file(request: Request):
+        """Get file from user, same rules as in Flask mode.
+
+        File is written in chunks to hidden temporary file in UPLOAD_FOLDER
+        first, hashing it on the way, and renamed only when complete, so
+        partial uploads are never listed.
+
+        """
+        form = await request.form()
+        # check if the post request has the file part
+        if 'file' not in form:
+            return JSONResponse({'success': False, 'error': 'No file'}, status_code=400)
+        file = form['file']
+        # if user does not select file, browser also
+        # submit an empty part without filename
+        if not getattr(file, 'filename', ''):
+            return JSONResponse({'success': False, 'error': 'File not selected'}, status_code=400)
+
+        filename = upload_path(file.filename)
+        # temporary file in the same folder, so it can be renamed, hidden files are not listed as uploads
+        tmp_fd, tmp_filename = tempfile.mkstemp(prefix=Database.partial_upload_prefix, dir=Path(filename).parent)
+        os.close(tmp_fd)
+        try:
+            sha256_hash = sha256()
+            async with await anyio.open_file(tmp_filename, 'wb') as tmp_file:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    sha256_hash.update(chunk)
+                    await tmp_file.write(chunk)
+
+            # if file exists and content is same do not save again
+            if (stored_file := Path(filename)).exists():
+                if await run_in_threadpool(Reader.sha256sum, stored_file) == sha256_hash.hexdigest():
+                    database.touch_upload(filename)
+                    return JSONResponse({'success': True})
+                # same filename but different content - not allowed, sorry
+                return JSONResponse({'success': False, 'error': 'File with the same name already exists, '
+                                                                'unfortunately it is not allowed yet'},
+                                    status_code=400)
+            # everything's ok, move file under UPLOAD_FOLDER
+            await anyio.Path(tmp_filename).rename(filename)
+        finally:
+            await form.close()
+            await anyio.Path(tmp_filename).unlink(missing_ok=True)
+
+        return JSONResponse({'success': True})
+
+    return [
+        Route('/', index, methods=['GET']),
+        Route('/api/files', files_list, methods=['GET']),
+        Route('/api/storage', storage_usage, methods=['GET']),
+        Route('/api/extensions', extensions_list, methods=['GET']),
+        Route('/api/analyze', analyze_file, methods=['POST']),
+        Route('/api/column', column_details, methods=['POST']),
+        Route('/api/windows', analyze_windows, methods=['POST']),
+        Route('/api/aggregate', aggregate_files, methods=['POST']),
+        Route('/api/upload', get_user_file, methods=['POST']),
+        Mount('/static', StaticFiles(directory='static'), name='static'),
+    ]
+
+
+def create_asgi_app(app_config: AppConfig, workers: int = None) -> Starlette:
+    """Create ASGI application, alternative to Flask one for serving under load.
+
+    Args:
+        app_config (AppConfig): application configuration
+        workers (int): number of processes for analyses, if None - number of CPUs
+    """
+    if app_config.ENV not in ('development', 'production'):
+        raise WrongEnvironment(app_config.ENV)
+
+    database = Database('data/users.pickle', 'data/analyses.pickle', app_config.UPLOAD_FOLDER)
+    retention = Retention(database, max_size=app_config.MAX_UPLOADS_SIZE, max_age=app_config.MAX_UPLOAD_AGE,
+                          interval=app_config.RETENTION_INTERVAL)
+    # server process already runs threads, so workers are not forked from it
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # always in background, as partial uploads left by interrupted requests are removed too
+        retention.start()
+        yield
+        retention.stop()
+        pool.shutdown()
+
+    return Starlette(
+        debug=app_config.ENV == 'development',
+        routes=add_api(app_config, database, retention, pool),
+        middleware=[Middleware(GZipMiddleware, minimum_size=MIN_COMPRESS_SIZE)],
+        lifespan=lifespan,
+    )
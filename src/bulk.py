@@ -0,0 +1,205 @@
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from pathlib import Path
+from string import digits
+from typing import Dict, List, Optional
+
+from src.analysis import AggregateAnalysis, DigitCounterAnalysis, Reader
+from src.database import Database
+from src.utils import Term
+
+
+class WrongFormat(Exception):
+    """Exception raised when summary format is not supported."""
+
+    def __init__(self, fmt: str):
+        self.message = f'Wrong summary format = {fmt}, options = {BulkAnalysis.supported_formats}'
+        super().__init__(self.message)
+
+
+def file_id_task(filename: str, ext: str) -> str:
+    """Get analysis id for file, run in worker process"""
+    return Reader(filename, ext).id
+
+
+def analyze_task(filename: str, ext: str) -> DigitCounterAnalysis:
+    """Analyze file, run in worker process"""
+    return DigitCounterAnalysis(filename, ext=ext)
+
+
+class BulkAnalysis:
+    """Class for analyzing many files at once, without running server.
+
+    Files are hashed and analyzed in parallel using process pool. Analyses
+    already stored in database (same content hash) are reused, new ones
+    are added to database. For each file summary is written to output
+    directory, along with overall report for all files.
+
+    Args:
+        database (Database): database with stored analyses
+        output_dir (str): directory where summaries will be written
+        fmt (str): summaries format, one of `supported_formats`
+        ext (str): file format, if empty, try recognizing by extension
+        workers (int): number of worker processes, if None - number of CPUs
+    """
+
+    supported_formats = ['json', 'csv']
+
+    def __init__(self, database: Database, output_dir: str, /, *,
+                 fmt: str = 'json', ext: str = '', workers: Optional[int] = None):
+        if fmt not in BulkAnalysis.supported_formats:
+            raise WrongFormat(fmt)
+
+        self.database = database
+        self.output_dir = Path(output_dir)
+        self.fmt = fmt
+        self.ext = ext
+        self.workers = workers
+
+    def run(self, paths: List[str]) -> Dict:
+        """Analyze all files found under paths, write summaries and return overall report"""
+        files = BulkAnalysis.collect_files(paths)
+        Term.info(f'Found {len(files)} files to analyze')
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # first hash files to know which analyses can be reused
+            ids_futures = {file: pool.submit(file_id_task, str(file), self.ext) for file in files}
+
+            errors = {}
+            analyses = {}
+            analyses_futures = {}
+            for file, future in ids_futures.items():
+                try:
+                    analysis_id = future.result()
+                except Exception as e:
+                    # e.g. file removed, not readable or broken symlink
+                    errors[file] = BulkAnalysis.error_message(e)
+                    continue
+
+                if analysis := self.database.get_analysis(analysis_id):
+                    analyses[file] = analysis
+                else:
+                    analyses_futures[file] = pool.submit(analyze_task, str(file), self.ext)
+
+            reused = set(analyses)
+            for file, future in analyses_futures.items():
+                try:
+                    analyses[file] = future.result()
+                except Exception as e:
+                    errors[file] = BulkAnalysis.error_message(e)
+
+        # store new analyses at once, same file may be found twice under different paths
+        new_analyses = {
+            analysis.id: analysis
+            for file, analysis in analyses.items()
+            if file not in reused
+        }
+        self.database.add_analyses(list(new_analyses.values()))
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        report = {'files': [], 'errors': {str(file): error for file, error in errors.items()}}
+        for file in files:
+            if file not in analyses:
+                Term.error(f'{file}: {errors[file]}')
+                continue
+            analysis = analyses[file]
+            summary_file = self.write_summary(file, analysis)
+            report['files'].append({
+                'path': str(file),
+                'summary': str(summary_file),
+                'reused': file in reused,
+                **BulkAnalysis.file_report(analysis),
+            })
+            Term.ok(f'{file} -> {summary_file}')
+
+        if analyses:
+            aggregate = AggregateAnalysis(list(analyses.values()))
+            report['aggregate'] = {
+                'stats': aggregate.get_stats(),
+                'lead_frequenters': aggregate.get_frequenters('lead'),
+            }
+
+        report_file = self.write_report(report)
+        Term.info(f'Analyzed {len(analyses)} files ({len(reused)} reused, {len(errors)} errors), '
+                  f'report = {report_file}')
+        return report
+
+    def write_summary(self, file: Path, analysis: DigitCounterAnalysis) -> Path:
+        """Write summary of single file analysis, same content as returned by API"""
+        # content hash in name, so files with the same names from different directories do not collide
+        summary_file = self.output_dir / f'{file.name}.{analysis.id[:12]}.{self.fmt}'
+        if self.fmt == 'json':
+            with summary_file.open('w') as f:
+                json.dump({
+                    'stats': analysis.get_stats(),
+                    'lead_frequenters': analysis.get_frequenters('lead'),
+                }, f, indent=2)
+        else:
+            rows = BulkAnalysis.columns_rows(analysis.get_stats()['benford'], analysis.get_frequenters('lead'))
+            BulkAnalysis.write_csv(summary_file, ['column', 'benford', *digits[1:]], rows)
+        return summary_file
+
+    def write_report(self, report: Dict) -> Path:
+        """Write overall report for all files"""
+        report_file = self.output_dir / f'report.{self.fmt}'
+        if self.fmt == 'json':
+            with report_file.open('w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            fields = ['path', 'summary', 'reused', 'filename', 'hash', 'parsed_lines', 'omitted_lines',
+                      'columns', 'min_benford']
+            rows = [[file_report[field] for field in fields] for file_report in report['files']]
+            BulkAnalysis.write_csv(report_file, fields, rows)
+        return report_file
+
+    @staticmethod
+    def file_report(analysis: DigitCounterAnalysis) -> Dict:
+        """Short report of single file analysis"""
+        stats = analysis.get_stats()
+        return {
+            'filename': stats['filename'],
+            'hash': stats['hash'],
+            'parsed_lines': stats['parsed_lines'],
+            'omitted_lines': stats['omitted_lines'],
+            'columns': stats['header_size'],
+            'min_benford': min(stats['benford'].values(), default=None),
+        }
+
+    @staticmethod
+    def error_message(e: Exception) -> str:
+        """Error message for report, some exceptions have no message at all"""
+        return str(e) or repr(e)
+
+    @staticmethod
+    def columns_rows(benford: Dict[str, float], frequenters: Dict[str, Dict[str, float]]) -> List[List]:
+        """Rows with Benford's law p-value and lead digits frequencies per column"""
+        return [
+            [column, benford[column], *(frequenter[digit] for digit in digits[1:])]
+            for column, frequenter in frequenters.items()
+        ]
+
+    @staticmethod
+    def write_csv(file: Path, header: List[str], rows: List[List]):
+        with file.open('w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    @staticmethod
+    def collect_files(paths: List[str]) -> List[Path]:
+        """Get files to analyze from directories (recursively, only supported extensions) or globs"""
+        files = []
+        for path in paths:
+            if (directory := Path(path)).is_dir():
+                files.extend(
+                    file
+                    for file in sorted(directory.glob('**/*'))
+                    if file.is_file() and file.suffix.lower() in Reader.supported_extensions
+                )
+            else:
+                files.extend(Path(file) for file in sorted(glob(path, recursive=True)) if Path(file).is_file())
+
+        # remove duplicates, keep order
+        return list(dict.fromkeys(files))
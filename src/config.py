@@ -3,6 +3,20 @@ import json
 DEF_CONFIG_FILENAME = 'cfg.json'
 
 
+class WrongEnvironment(Exception):
+    """Exception raised when wrong environment is set.
+
+    Attributes:
+        env -- input environment value which cased exception
+        message -- explanation of the error
+    """
+
+    def __init__(self, env: str, message: str = 'Wrong environment, options = ["production", "development"]'):
+        self.env = env
+        self.message = message
+        super().__init__(self.message)
+
+
 class AppConfig:
     """Class used to load config from file"""
 
@@ -10,6 +24,9 @@ class AppConfig:
     DEF_ENV = "production"
     DEF_HOST = "127.0.0.1"
     DEF_PORT = 5000
+    DEF_MAX_UPLOADS_SIZE = 0
+    DEF_MAX_UPLOAD_AGE = 0
+    DEF_RETENTION_INTERVAL = 3600
 
     def __init__(self, config_filename: str):
         with open(config_filename, 'r') as cfg_file:
@@ -19,3 +36,6 @@ class AppConfig:
         self.ENV = config.get("ENV", AppConfig.DEF_ENV)
         self.HOST = config.get("HOST", AppConfig.DEF_HOST)
         self.PORT = config.get("PORT", AppConfig.DEF_PORT)
+        self.MAX_UPLOADS_SIZE = config.get("MAX_UPLOADS_SIZE", AppConfig.DEF_MAX_UPLOADS_SIZE)
+        self.MAX_UPLOAD_AGE = config.get("MAX_UPLOAD_AGE", AppConfig.DEF_MAX_UPLOAD_AGE)
+        self.RETENTION_INTERVAL = config.get("RETENTION_INTERVAL", AppConfig.DEF_RETENTION_INTERVAL)
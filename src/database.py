@@ -1,9 +1,13 @@
+import os
 import pickle
+import tempfile
+from collections import OrderedDict
+from fnmatch import fnmatch
 from pathlib import Path
 from threading import Lock
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Union
 
-from src.analysis import DigitCounterAnalysis
+from src.analysis import AggregateAnalysis, DigitCounterAnalysis, WrongFile
 
 
 class UserExists(Exception):
@@ -22,6 +26,14 @@ class AnalysisExists(Exception):
         super().__init__(self.message)
 
 
+class AnalysisNotFound(Exception):
+    """Exception raised when analysis is not in database."""
+
+    def __init__(self, a_hash: str):
+        self.message = f'Analysis has not been done yet, hash = {a_hash}'
+        super().__init__(self.message)
+
+
 class User:
     def __init__(self, name: str):
         self.id = name
@@ -32,12 +44,20 @@ class Database:
 
     Currently databases are stored as serialized objects in .pickle files.
     Through this objects server can obtain list of files uploaded by users.
-    Two databases are available:
+    Three databases are available:
         - users: with all users
         - analyses: with all analyses performed on data
+        - uploads: names of files uploaded by users linked to analyses ids
+          of their content, by default stored next to analyses database
     """
 
-    def __init__(self, users_db_file: str, analyses_db_file: str, upload_folder: str):
+    # prefix of hidden temporary files in upload folder, written while upload is in progress
+    partial_upload_prefix = '.upload-'
+
+    # max number of aggregates cached in memory, least recently used are dropped first
+    max_cached_aggregates = 128
+
+    def __init__(self, users_db_file: str, analyses_db_file: str, upload_folder: str, uploads_db_file: str = ''):
         # load file with help
         with open('templates/help.html') as help_file:
             self._app_help = help_file.read()
@@ -47,10 +67,32 @@ class Database:
         # store files to know where to save databases
         self._users_file = Path(users_db_file)
         self._analyses_file = Path(analyses_db_file)
+        self._uploads_file = Path(uploads_db_file) if uploads_db_file \
+            else self._analyses_file.with_name('uploads.pickle')
 
         # load databases
         self._users = Database.load_default_db(users_db_file)
         self._analyses = Database.load_default_db(analyses_db_file)
+        if migrated_ids := Database.migrate_analyses(self._analyses):
+            Database.store(self._analyses_file, self._analyses)
+        uploads_existed = self._uploads_file.exists()
+        self._uploads = Database.load_default_db(str(self._uploads_file))
+        if not uploads_existed:
+            # link already stored analyses with filenames they were done for
+            for analysis in self._analyses.values():
+                if analysis.get_windows() is None:
+                    self._uploads.setdefault(analysis.get_stats()['filename'], []).append(analysis.id)
+            Database.store(self._uploads_file, self._uploads)
+        elif migrated_ids:
+            self._uploads = {
+                name: [migrated_ids.get(analysis_id, analysis_id) for analysis_id in analyses_ids]
+                for name, analyses_ids in self._uploads.items()
+            }
+            Database.store(self._uploads_file, self._uploads)
+
+        # aggregates are computed from stored analyses, so cache them only in memory
+        self._aggregates = OrderedDict()
+        self._aggregates_by_id = {}
 
         self._path_to_files = upload_folder
         # be sure that folder exists
@@ -61,22 +103,40 @@ class Database:
         with self.lock:
             Database.store(self._users_file, self._users)
             Database.store(self._analyses_file, self._analyses)
+            Database.store(self._uploads_file, self._uploads)
 
     def get_filenames(self):
         """Get filenames to users files uploaded to server"""
         paths = Path(self._path_to_files).glob('**/*')
-        filenames = [file.name for file in paths if file.is_file()]
+        filenames = [file.name for file in paths if Database.is_upload(file)]
         return filenames
 
+    @staticmethod
+    def is_upload(file: Path) -> bool:
+        """Check if file is uploaded by user, hidden files are uploads in progress"""
+        # uploaded filenames are secured, so they never start with dot
+        return file.is_file() and not file.name.startswith('.')
+
+    def get_upload_folder(self) -> Path:
+        return Path(self._path_to_files)
+
+    def touch_upload(self, filename: str):
+        """Mark file uploaded by user as used now, least recently used files are removed first"""
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+
     def get_app_help(self):
         """App usage help stored at 'docs/help.html'"""
         return self._app_help
 
     def add_user(self, user: User):
-        if user.id in self._users:
-            raise UserExists(user.id)
-        self._users[user.id] = user
-        self.save()
+        with self.lock:
+            if user.id in self._users:
+                raise UserExists(user.id)
+            self._users[user.id] = user
+            Database.store(self._users_file, self._users)
 
     def add_analysis(self, analysis: DigitCounterAnalysis):
         """Add new analysis.
@@ -84,12 +144,26 @@ class Database:
         Analysis id is basically file content hash + extension used to analyze.
         Adding same analysis raising exception.
         """
+        self.add_analyses([analysis])
+
+    def add_analyses(self, analyses: List[DigitCounterAnalysis]):
+        """Add many new analyses, storing database only once.
+
+        Adding analysis which is already in database raising exception,
+        in such case none of analyses is added. Analyses may be added
+        from many threads, so database is changed and stored under lock.
+        """
+        with self.lock:
+            for analysis in analyses:
+                if analysis.id in self._analyses:
+                    raise AnalysisExists(analysis.id)
+            for analysis in analyses:
+                self._analyses[analysis.id] = analysis
+            Database.store(self._analyses_file, self._analyses)
 
-        # check if analysis in database
-        if analysis.id in self._analyses:
-            raise AnalysisExists(analysis.id)
-        self._analyses[analysis.id] = analysis
-        self.save()
+    def get_analyses(self) -> List[DigitCounterAnalysis]:
+        with self.lock:
+            return list(self._analyses.values())
 
     def get_user(self, username: str) -> Optional[User]:
         return self._users.get(username)
@@ -98,6 +172,101 @@ class Database:
         """Based on `analysis_id = file hash + extension`, get analysis from database"""
         return self._analyses.get(analysis_id)
 
+    def find_analyses(self, pattern: str, ext: str = '') -> List[DigitCounterAnalysis]:
+        """Get single analysis per file content of files which names match pattern, optionally with extension.
+
+        Windowed and strict analyses have mostly the same counters as plain
+        ones, so they would be counted twice. Strict analysis is used only
+        if file was not analyzed again with recovery.
+        """
+        found = {}
+        for analysis in self.get_analyses():
+            stats = analysis.get_stats()
+            if analysis.get_windows() is not None \
+                    or not fnmatch(stats['filename'], pattern) \
+                    or (ext and stats['ext'] != ext):
+                continue
+            # not windowed analysis with recovery has id equal to file id
+            if stats['hash'] not in found or analysis.id == stats['hash']:
+                found[stats['hash']] = analysis
+        return list(found.values())
+
+    def link_upload(self, filename: str, analysis_id: str):
+        """Link uploaded file with analysis of its content, latest linked analysis is last"""
+        name = Path(filename).name
+        with self.lock:
+            analyses_ids = self._uploads.setdefault(name, [])
+            if analyses_ids and analyses_ids[-1] == analysis_id:
+                return
+            if analysis_id in analyses_ids:
+                analyses_ids.remove(analysis_id)
+            analyses_ids.append(analysis_id)
+            Database.store(self._uploads_file, self._uploads)
+
+    def get_upload_links(self) -> Dict[str, List[str]]:
+        """Get uploaded files names with ids of analyses linked to them"""
+        with self.lock:
+            return {name: list(analyses_ids) for name, analyses_ids in self._uploads.items()}
+
+    def get_removed_file_analysis(self, filename: str, ext: str = '') -> DigitCounterAnalysis:
+        """Get latest analysis linked to uploaded file which is no longer stored"""
+        for analysis_id in reversed(self.get_upload_links().get(filename, [])):
+            analysis = self.get_analysis(analysis_id)
+            if analysis and (not ext or analysis.get_stats()['ext'] == ext):
+                return analysis
+        raise WrongFile(filename, 'not-exists')
+
+    def get_aggregate(self, analysis_ids: Iterable[str]) -> AggregateAnalysis:
+        """Get aggregate over stored analyses, cached by sorted set of analyses ids"""
+        key = AggregateAnalysis.aggregate_key(analysis_ids)
+        with self.lock:
+            if (aggregate := self._aggregates.get(key)) is not None:
+                self._aggregates.move_to_end(key)
+                return aggregate
+
+        analyses = []
+        for analysis_id in key:
+            if not (analysis := self.get_analysis(analysis_id)):
+                raise AnalysisNotFound(analysis_id)
+            analyses.append(analysis)
+
+        aggregate = AggregateAnalysis(analyses)
+        with self.lock:
+            self._aggregates[key] = aggregate
+            self._aggregates_by_id[aggregate.id] = aggregate
+            while len(self._aggregates) > Database.max_cached_aggregates:
+                _, dropped = self._aggregates.popitem(last=False)
+                self._aggregates_by_id.pop(dropped.id, None)
+        return aggregate
+
+    def get_analysis_or_aggregate(self, analysis_id: str) -> Optional[Union[DigitCounterAnalysis, AggregateAnalysis]]:
+        """Get analysis from database, or already computed aggregate with that id"""
+        if analysis := self._analyses.get(analysis_id):
+            return analysis
+        with self.lock:
+            if (aggregate := self._aggregates_by_id.get(analysis_id)) is not None:
+                self._aggregates.move_to_end(aggregate.ids)
+            return aggregate
+
+    @staticmethod
+    def migrate_analyses(analyses: dict) -> Dict[str, str]:
+        """Move analyses done before lines recovery to strict ids, return moved ids mapping.
+
+        Such analyses omitted lines with wrong number of fields, so they are
+        kept as strict ones, and analyses with recovery are done again.
+        """
+        legacy_ids = [
+            analysis_id
+            for analysis_id, analysis in analyses.items()
+            if 'recovered_lines' not in analysis.get_stats()
+        ]
+        migrated_ids = {}
+        for analysis_id in legacy_ids:
+            analysis = analyses.pop(analysis_id)
+            analysis.id = migrated_ids[analysis_id] = f'{analysis_id}:strict'
+            analyses.setdefault(analysis.id, analysis)
+        return migrated_ids
+
     @staticmethod
     def load_default_db(filename: str) -> dict:
         """Load default database, currently pickled file"""
@@ -109,9 +278,16 @@ class Database:
 
     @staticmethod
     def store(file: Path, data: dict):
+        """Store database in temporary file first, so database file is never left truncated"""
         file.parent.mkdir(parents=True, exist_ok=True)
-        with file.open('wb') as f:
-            pickle.dump(data, f)
+        tmp_fd, tmp_filename = tempfile.mkstemp(prefix=f'.{file.name}-', dir=file.parent)
+        try:
+            with os.fdopen(tmp_fd, 'wb') as f:
+                pickle.dump(data, f)
+            os.replace(tmp_filename, file)
+        except BaseException:
+            Path(tmp_filename).unlink(missing_ok=True)
+            raise
 
     @staticmethod
     def load(file: Path) -> dict:
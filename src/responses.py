@@ -0,0 +1,115 @@
+import gzip
+import json
+from string import digits
+from typing import Dict, List, Optional
+
+# optional dependencies, checked once as failed imports are not cached
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.benone.columnar+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# responses smaller than that are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+class WrongLayout(Exception):
+    """Exception raised when response layout is not supported."""
+
+    def __init__(self, mimetype: str):
+        self.message = f'Wrong response layout = {mimetype}, options = {Layout.get_supported_mimetypes()}'
+        super().__init__(self.message)
+
+
+class Layout:
+    """Class for building and serializing API responses in negotiated layout.
+
+    Default layout is plain JSON with dictionaries per column, as always.
+    Compact layouts (columnar JSON and MessagePack, if `msgpack` installed)
+    keep columns names once in list, and per column values in arrays in
+    the same order, with lead digits 1-9 as implicit arrays positions.
+    """
+
+    lead_digits = digits[1:]
+
+    @staticmethod
+    def get_supported_mimetypes() -> List[str]:
+        """Mimetypes in preference order, plain JSON first to be picked for `*/*`"""
+        mimetypes = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+        if msgpack is not None:
+            mimetypes.append(MSGPACK_MIMETYPE)
+        return mimetypes
+
+    @staticmethod
+    def is_compact(mimetype: str) -> bool:
+        return mimetype in (COLUMNAR_MIMETYPE, MSGPACK_MIMETYPE)
+
+    @staticmethod
+    def columnar(stats: Dict, frequenters: Dict[str, Dict[str, float]], detail: bool = False) -> Dict:
+        """Convert analysis stats and lead frequenters to columnar layout.
+
+        Benford's law p-values are moved from stats to array per column,
+        lead frequenters are included only if `detail` requested, otherwise
+        they should be fetched per column when needed.
+        """
+        columns = list(frequenters)
+        benford = stats.get('benford', {})
+        result = {
+            'stats': {key: value for key, value in stats.items() if key != 'benford'},
+            'columns': columns,
+            'digits': list(Layout.lead_digits),
+            'benford': [benford.get(column) for column in columns],
+        }
+        if detail:
+            result['lead_frequenters'] = [
+                Layout.column_frequencies(frequenters[column])
+                for column in columns
+            ]
+        return result
+
+    @staticmethod
+    def column_frequencies(frequenter: Dict[str, float]) -> List[float]:
+        """Lead digits frequencies of single column as array"""
+        return [frequenter[digit] for digit in Layout.lead_digits]
+
+    @staticmethod
+    def serialize(data: Dict, mimetype: str) -> bytes:
+        if mimetype == MSGPACK_MIMETYPE and msgpack is not None:
+            return msgpack.packb(data)
+        if mimetype in (JSON_MIMETYPE, COLUMNAR_MIMETYPE):
+            return json.dumps(data, separators=(',', ':')).encode()
+        raise WrongLayout(mimetype)
+
+
+class Compression:
+    """Class for compressing responses bodies, brotli used only if `brotli` installed."""
+
+    @staticmethod
+    def get_supported_encodings() -> List[str]:
+        """Content encodings in preference order"""
+        encodings = []
+        if brotli is not None:
+            encodings.append('br')
+        encodings.append('gzip')
+        return encodings
+
+    @staticmethod
+    def should_compress(body: bytes, encoding: Optional[str]) -> bool:
+        return encoding is not None and len(body) >= MIN_COMPRESS_SIZE
+
+    @staticmethod
+    def compress(body: bytes, encoding: str) -> bytes:
+        if encoding == 'br' and brotli is not None:
+            return brotli.compress(body)
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=6)
+        return body
@@ -0,0 +1,157 @@
+import time
+from pathlib import Path
+from threading import Event, Thread
+from typing import Dict, List, NamedTuple, Optional
+
+from src.database import Database
+from src.utils import Term
+
+
+class Upload(NamedTuple):
+    path: Path
+    size: int
+    last_access: float
+
+
+class Retention:
+    """Class for keeping storage of users files within quotas.
+
+    Uploaded files are removed when older (since last use) than `max_age`
+    seconds, or least recently used first when their total size exceeds
+    `max_size` bytes. Analyses are compact and always kept, so results of
+    already analyzed files are still available after their files are removed.
+    Files never analyzed would be lost entirely, so they are not removed,
+    only reported as orphans, but their size still counts to `max_size`.
+    Files used in the last `grace_period` seconds are never removed, so
+    requests in progress are not affected. Partial uploads left by
+    interrupted requests are removed after `grace_period` too.
+
+    Args:
+        database (Database): database with users files and analyses
+        max_size (int): max total size of uploaded files in bytes, 0 = unlimited
+        max_age (int): max seconds since last use of uploaded file, 0 = unlimited
+        interval (int): seconds between background compactions
+        grace_period (int): seconds since last use during which file is never removed
+    """
+
+    def __init__(self, database: Database, /, *,
+                 max_size: int = 0, max_age: int = 0, interval: int = 3600, grace_period: int = 60):
+        self.database = database
+        self.max_size = max_size
+        self.max_age = max_age
+        self.interval = interval
+        self.grace_period = grace_period
+
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def get_uploads(self) -> List[Upload]:
+        """Get uploaded files, least recently used first"""
+        uploads = []
+        for file in self.database.get_upload_folder().glob('**/*'):
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            if Database.is_upload(file):
+                uploads.append(Upload(file, stat.st_size, stat.st_mtime))
+        uploads.sort(key=lambda upload: upload.last_access)
+        return uploads
+
+    def get_orphans(self) -> Dict[str, List[str]]:
+        """Get files never analyzed and analyses which are not linked to any stored file"""
+        filenames = {upload.path.name for upload in self.get_uploads()}
+        links = self.database.get_upload_links()
+        linked_ids = {
+            analysis_id
+            for filename in filenames
+            for analysis_id in links.get(filename, [])
+        }
+
+        return {
+            'files': sorted(filename for filename in filenames if not links.get(filename)),
+            'analyses': sorted(
+                analysis.id
+                for analysis in self.database.get_analyses()
+                # windowed analyses are additional views of plain ones
+                if analysis.get_windows() is None and analysis.id not in linked_ids
+            ),
+        }
+
+    def get_usage(self) -> Dict[str, int]:
+        uploads = self.get_uploads()
+        return {
+            'files': len(uploads),
+            'size': sum(upload.size for upload in uploads),
+            'max_size': self.max_size,
+            'max_age': self.max_age,
+        }
+
+    def evict(self, now: Optional[float] = None) -> List[str]:
+        """Remove analyzed files exceeding quotas, return names of removed files"""
+        now = time.time() if now is None else now
+        uploads = self.get_uploads()
+        total_size = sum(upload.size for upload in uploads)
+        links = self.database.get_upload_links()
+
+        evicted = []
+        for upload in uploads:
+            age = now - upload.last_access
+            if age < self.grace_period:
+                # uploads are sorted, so all next ones are used recently too
+                break
+            too_old = self.max_age and age > self.max_age
+            too_big = self.max_size and total_size > self.max_size
+            if not (too_old or too_big) or not links.get(upload.path.name):
+                continue
+            upload.path.unlink(missing_ok=True)
+            total_size -= upload.size
+            evicted.append(upload.path.name)
+        return evicted
+
+    def remove_partial_uploads(self, now: Optional[float] = None) -> List[str]:
+        """Remove partial uploads not written for `grace_period` seconds, return names of removed files"""
+        now = time.time() if now is None else now
+        removed = []
+        for file in self.database.get_upload_folder().glob(f'**/{Database.partial_upload_prefix}*'):
+            try:
+                if now - file.stat().st_mtime < self.grace_period:
+                    continue
+                file.unlink()
+            except FileNotFoundError:
+                # upload finished in the meantime
+                continue
+            removed.append(file.name)
+        return removed
+
+    def compact(self) -> Dict[str, List[str]]:
+        """Remove files exceeding quotas, databases are not changed as analyses are kept"""
+        evicted = self.evict()
+        partial = self.remove_partial_uploads()
+        orphans = self.get_orphans()
+        if evicted:
+            Term.info(f'Retention removed {len(evicted)} files: {", ".join(evicted)}')
+        if partial:
+            Term.info(f'Retention removed {len(partial)} partial uploads: {", ".join(partial)}')
+        return {'evicted': evicted, 'partial': partial, **orphans}
+
+    def start(self):
+        """Start compacting storage in background thread every `interval` seconds"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.compact()
+                except Exception as e:
+                    Term.error(f'Retention failed: {e}')
+
+        self._thread = Thread(target=run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -34,37 +34,54 @@ var analysis_section = new Vue({
   el: '#analysis-section',
   data() {
     return {
-      stats: undefined,                         // statistics with benfords law analysis
-      lead_frequenters: undefined,              // lead frequenters provides data for digits
+      id: undefined,                            // analysis id, used to fetch columns details
+      stats: undefined,                         // statistics from analysis
+      columns: undefined,                       // columns names from analysis
+      benford: undefined,                       // benfords law p-values, in the same order as columns
+      lead_frequencies: {},                     // lead digits frequencies of already selected columns
       ben: {'value': 0.0, 'variant': 'danger'}, // current column benford's law compliant
       data: undefined,
     }
   },
   methods: {
-    set: function(stats, lead_frequenters) {
+    set: function(id, stats, columns, benford) {
+        this.id = id;
         this.stats = stats;
-        this.lead_frequenters = lead_frequenters;
+        this.columns = columns;
+        this.benford = benford;
+        this.lead_frequencies = {};
 
-        // get columns names
-        let columns = Object.keys(lead_frequenters);
-        file_columns.populate_columns(columns);
+        file_columns.populate_columns(columns.slice());
     },
     /*
-        Updating chart with new dataset from `lead_frequenters`
+        Updating chart with lead digits frequencies of column,
+        fetched from server only when column is selected for the first time
     */
     update_chart: function(column) {
-        this.ben['pvalue'] = this.stats['benford'][column];                         // get benfords law results
+        this.ben['pvalue'] = this.benford[this.columns.indexOf(column)];            // get benfords law results
         this.ben['value'] = Number((this.ben['pvalue'] * 100.0).toFixed(4));        // set value as pval * 100
         this.ben['variant'] = this.ben['pvalue'] >= 0.95 ? 'success' : 'danger';    // set proper prompt
 
-        let lead_frequenter = this.lead_frequenters[column];    // pick proper frequenter and set data
-        var new_data = [];
-        for (const i of Array(9).keys()) {
-            const digit = (i + 1).toString(); // starts from 1 to 0
-            new_data.push(lead_frequenter[digit])
+        if (column in this.lead_frequencies) {
+            this.draw_chart(this.lead_frequencies[column]);
+            return;
         }
-
-        chart.data.datasets[1].data = new_data;
+        axios.post('/api/column', {'id': this.id, 'column': column}
+          ).then(response => {
+            this.lead_frequencies[column] = response.data.lead_frequencies;  // digits 1-9 frequencies
+            this.draw_chart(this.lead_frequencies[column]);
+          })
+          .catch(error => {
+            let reason = error.response === undefined ? 'undefined error happend' : error.response.data.error;
+            this.$bvToast.toast(`Could not get column details: ${reason}`, {
+              title: 'Error',
+              variant: 'danger',
+              autoHideDelay: 2000
+            });
+          });
+    },
+    draw_chart: function(lead_frequencies) {
+        chart.data.datasets[1].data = lead_frequencies;
         chart.update();
     }
   },
@@ -187,11 +204,17 @@ var file_analyze = new Vue({
             });
         return;
       }
-      axios.post('/api/analyze', {'filename': filename, 'ext': this.selected_ext}
+      axios.post('/api/analyze', {'filename': filename, 'ext': this.selected_ext}, {
+            headers: {
+              'Accept': 'application/vnd.benone.columnar+json'  // compact layout, details fetched per column
+            }
+          }
         ).then(response => {
-            let stats = response.data.stats;                        // statistics with benfords law analysis
-            let lead_frequenters = response.data.lead_frequenters;  // frequenters for each column in data
-            analysis_section.set(stats, lead_frequenters);
+            let id = response.data.id;              // analysis id, may differ from file hash
+            let stats = response.data.stats;        // statistics from analysis
+            let columns = response.data.columns;    // columns names in data
+            let benford = response.data.benford;    // benfords law p-values for each column
+            analysis_section.set(id, stats, columns, benford);
             this.show = false;                                      // let do analysis again
             file_columns.$refs['file-columns-select'].focus();      // focus on column select
             file_analyze.$bvToast.toast(`File has been analyzed, now select column`, {
@@ -1,7 +1,11 @@
 import os
+import pickle
+import tempfile
 import unittest
+from pathlib import Path
 
-from src.analysis import DigitCounterAnalysis, WrongFile, WrongLetter, WrongColumn
+from src.analysis import AggregateAnalysis, DigitCounterAnalysis, EmptyAggregate, Reader, WindowCounters, \
+    WrongFile, WrongLetter, WrongColumn, WrongWindow
 
 
 class TestAnalysis(unittest.TestCase):
@@ -19,6 +23,11 @@ class TestAnalysis(unittest.TestCase):
         with self.assertRaises(WrongFile):
             DigitCounterAnalysis(self.wrong_filename)
 
+    def test_errors_pickle(self):
+        # errors raised in worker processes are sent back pickled
+        for error in (WrongFile('data.csv', 'empty'), WrongColumn('a'), WrongWindow(2, 'a')):
+            self.assertEqual(str(pickle.loads(pickle.dumps(error))), str(error))
+
     def test_counting_whole(self):
         right_answers = {'0': 7, '1': 4, '2': 3, '3': 9, '4': 6, '5': 0, '6': 0, '7': 5, '8': 8, '9': 7}
         analysis = DigitCounterAnalysis(self.filename)
@@ -56,6 +65,173 @@ class TestAnalysis(unittest.TestCase):
             right_answer = right_answers[digit]
             self.assertEqual(answer, right_answer)
 
+    def test_aggregate(self):
+        analysis = DigitCounterAnalysis(self.filename)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # second file with the same header and only first data line
+            lines = Path(self.filename).read_text().splitlines(keepends=True)
+            other_filename = str(Path(tmp_dir) / 'other_data.tsv')
+            Path(other_filename).write_text(''.join(lines[:2]))
+            other_analysis = DigitCounterAnalysis(other_filename)
+
+        aggregate = AggregateAnalysis([analysis, other_analysis])
+        column = '7_2009'
+        for digit, count in analysis.get_counter(column).items():
+            self.assertEqual(aggregate.get_counter(column)[digit], count + other_analysis.get_counter(column)[digit])
+        self.assertEqual(aggregate.get_stats()['files'], 2)
+        self.assertIn(column, aggregate.get_stats()['benford'])
+
+    def test_aggregate_same_analysis(self):
+        analysis = DigitCounterAnalysis(self.filename)
+        aggregate = AggregateAnalysis([analysis, analysis])
+        self.assertEqual(aggregate.get_counters('lead'), analysis.get_counters('lead'))
+        self.assertEqual(aggregate.get_stats()['benford'], analysis.get_stats()['benford'])
+
+    def test_aggregate_empty(self):
+        with self.assertRaises(EmptyAggregate):
+            AggregateAnalysis([])
+
+    def test_windows_rows(self):
+        analysis = DigitCounterAnalysis(self.filename, window_size=2)
+        windows = analysis.get_windows()
+        self.assertEqual(len(windows), 2)
+        self.assertNotEqual(analysis.id, DigitCounterAnalysis(self.filename).id)
+
+        # windows counters sum up to whole file lead counters
+        column = '7_2009'
+        lead_counter = analysis.get_counters('lead')[column]
+        for digit in WindowCounters.lead_digits:
+            self.assertEqual(windows.get_counters(0)[column][digit] + windows.get_counters(1)[column][digit],
+                             lead_counter[digit])
+
+    def test_windows_column(self):
+        analysis = DigitCounterAnalysis(self.filename, window_column='State')
+        windows = analysis.get_windows()
+        self.assertEqual(len(windows), 1)
+        anomalous = windows.get_anomalous(count=2, min_digits=1)
+        self.assertEqual(len(anomalous), 2)
+        self.assertGreaterEqual(anomalous[0]['score'], anomalous[1]['score'])
+        self.assertNotIn('State', [score['column'] for score in windows.get_scores(min_digits=1)])
+        # too few digits for chi-square test by default
+        self.assertListEqual(windows.get_scores(), [])
+
+    def test_windows_wrong(self):
+        with self.assertRaises(WrongWindow):
+            DigitCounterAnalysis(self.filename, window_size=2, window_column='State')
+        with self.assertRaises(WrongColumn):
+            DigitCounterAnalysis(self.filename, window_column='wrong_column')
+
+    def test_windows_recovered_lines(self):
+        content = 'a,b,c\n1,2,3\n4,5\n6,7,8,9\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = self.write_tmp_file(tmp_dir, content.encode())
+            column_analysis = DigitCounterAnalysis(filename, window_column='c')
+            rows_analysis = DigitCounterAnalysis(filename, window_size=1)
+
+        # line without window column is counted for whole file only
+        column_windows = column_analysis.get_windows()
+        self.assertEqual(len(column_windows), 2)
+        self.assertEqual(column_analysis.get_count('4', 'a'), 1)
+        self.assertEqual(sum(column_windows.get_counters('3')['a'].values()), 1)
+        self.assertEqual(sum(column_windows.get_counters('8')['a'].values()), 1)
+
+        rows_windows = rows_analysis.get_windows()
+        self.assertEqual(len(rows_windows), 3)
+        self.assertEqual(rows_windows.get_counters(1)['b']['5'], 1)
+
+    def test_windows_chi_square(self):
+        # frequencies exactly as in Benford's law
+        counts = [int(frequency * 10) for frequency in DigitCounterAnalysis.benford_frequencies.values()]
+        self.assertAlmostEqual(WindowCounters.chi_square(counts, sum(counts)), 0.0, places=2)
+
+    def test_windows_sample_size(self):
+        # small window with only digits 9 and big window with twice more digits 1 than expected
+        content = 'g,a\n' + 'x,9\n' * 5 + 'y,1\n' * 600 + 'y,2\n' * 400
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = self.write_tmp_file(tmp_dir, content.encode())
+            analysis = DigitCounterAnalysis(filename, window_column='g')
+
+        windows = analysis.get_windows()
+        self.assertEqual(windows.get_anomalous(min_digits=1)[0]['window'], 'y')
+        self.assertListEqual([score['window'] for score in windows.get_anomalous()], ['y'])
+
+    def write_tmp_file(self, tmp_dir: str, content: bytes, name: str = 'data.csv') -> str:
+        filename = str(Path(tmp_dir) / name)
+        Path(filename).write_bytes(content)
+        return filename
+
+    def test_sniff_default(self):
+        sniff = Reader(self.filename).sniff
+        self.assertDictEqual(sniff, {'encoding': 'utf-8', 'delimiter': '\t', 'quotechar': '"', 'header_line': 0})
+
+    def test_sniff_encoding(self):
+        self.assertEqual(Reader.sniff_encoding('a;b\n'.encode('utf-8-sig')), 'utf-8-sig')
+        self.assertEqual(Reader.sniff_encoding('a;b\n'.encode('utf-16')), 'utf-16')
+        cut_sample = b'1' * (Reader.sniff_size - 1) + 'ż'.encode('utf-8')[:1]
+        self.assertEqual(Reader.sniff_encoding(cut_sample), 'utf-8')
+        self.assertEqual(Reader.sniff_encoding('café'.encode('latin-1')), 'cp1252')
+        self.assertEqual(Reader.sniff_encoding(b'\x81\xe9'), 'latin-1')
+
+    def test_sniff_preamble(self):
+        content = 'Ledger export\ngenerated 2020-01-01\nname;amount;count\nx;123;4\ny;234;5\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = self.write_tmp_file(tmp_dir, content.encode('utf-8-sig'))
+            analysis = DigitCounterAnalysis(filename)
+
+        sniff = analysis.get_stats()['sniff']
+        self.assertEqual(sniff['encoding'], 'utf-8-sig')
+        self.assertEqual(sniff['delimiter'], ';')
+        self.assertEqual(sniff['header_line'], 2)
+        self.assertEqual(analysis.get_counters('lead')['amount']['1'], 1)
+        self.assertEqual(analysis.get_stats()['parsed_lines'], 2)
+
+    def test_sniff_ragged_header(self):
+        content = 'id,amount,note\n1,123\n2,234\n3,345,x\n4,456\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = self.write_tmp_file(tmp_dir, content.encode())
+            analysis = DigitCounterAnalysis(filename)
+
+        self.assertEqual(analysis.get_stats()['sniff']['header_line'], 0)
+        self.assertListEqual(list(analysis.get_counters('lead')), ['id', 'amount', 'note'])
+        self.assertEqual(analysis.get_counters('lead')['amount']['1'], 1)
+        self.assertEqual(analysis.get_stats()['recovered_lines'], 3)
+
+    def test_sniff_trailing_delimiter(self):
+        content = 'Ledger export,2020\nid,amount,qty\n1,123,4,\n2,234,5,\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = self.write_tmp_file(tmp_dir, content.encode())
+            analysis = DigitCounterAnalysis(filename)
+
+        self.assertEqual(analysis.get_stats()['sniff']['header_line'], 1)
+        self.assertListEqual(list(analysis.get_counters('lead')), ['id', 'amount', 'qty'])
+        self.assertEqual(analysis.get_counters('lead')['id']['1'], 1)
+        self.assertEqual(analysis.get_stats()['recovered_lines'], 2)
+
+    def test_sniff_latin1(self):
+        content = 'nom,montant\ncafé,123\nthé,456\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = self.write_tmp_file(tmp_dir, content.encode('latin-1'))
+            analysis = DigitCounterAnalysis(filename)
+
+        self.assertEqual(analysis.get_stats()['sniff']['encoding'], 'cp1252')
+        self.assertEqual(analysis.get_count('4', 'montant'), 1)
+
+    def test_recover(self):
+        content = 'a,b,c\n1,2,3\n4,5\n6,7,8,9\n\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = self.write_tmp_file(tmp_dir, content.encode())
+            analysis = DigitCounterAnalysis(filename)
+            not_recovered = DigitCounterAnalysis(filename, recover=False)
+
+        stats = analysis.get_stats()
+        self.assertEqual(stats['recovered_lines'], 2)
+        self.assertEqual(stats['omitted_lines'], 1)
+        self.assertEqual(analysis.get_count('5', 'b'), 1)
+        self.assertEqual(analysis.get_count('9'), 0)
+        self.assertEqual(not_recovered.get_stats()['omitted_lines'], 3)
+        self.assertEqual(not_recovered.id, f'{analysis.id}:strict')
+        self.assertEqual(not_recovered.get_count('5', 'b'), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from src.analysis import DigitCounterAnalysis
+from src.asgi import add_api
+from src.config import AppConfig
+from src.database import Database
+from src.retention import Retention
+
+
+class TestAsgi(unittest.TestCase):
+    def setUp(self) -> None:
+        # when running from base directory need to add 'tests/' prefix
+        self.test_root_dir = '' if os.getcwd().endswith('tests') else 'tests/'
+
+        self.user_file = 'simple_data.tsv'
+        self.user_content = Path(f'{self.test_root_dir}data/users_files/{self.user_file}').read_bytes()
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_folder = self.tmp_dir.name
+        self.upload_folder = f'{self.data_folder}/users_files'
+        config_filename = f'{self.data_folder}/cfg.json'
+        with open(config_filename, 'w') as cfg_file:
+            json.dump({'UPLOAD_FOLDER': self.upload_folder}, cfg_file)
+
+        self.database = Database(f'{self.data_folder}/users.pickle', f'{self.data_folder}/analyses.pickle',
+                                 self.upload_folder)
+        self.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        routes = add_api(AppConfig(config_filename), self.database, Retention(self.database), self.pool)
+        self.client = TestClient(Starlette(routes=routes))
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.pool.shutdown()
+        self.tmp_dir.cleanup()
+
+    def upload(self, content: bytes, filename: str = ''):
+        return self.client.post('/api/upload', files={'file': (filename or self.user_file, content)})
+
+    def analyze(self):
+        return self.client.post('/api/analyze', json={'filename': self.user_file, 'ext': '.tsv'})
+
+    def test_upload(self):
+        response = self.upload(self.user_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Path(self.upload_folder, self.user_file).read_bytes(), self.user_content)
+        # temporary file is not left in upload folder
+        self.assertListEqual(os.listdir(self.upload_folder), [self.user_file])
+        self.assertDictEqual(self.client.get('/api/files').json(), {'files': [self.user_file]})
+
+    def test_upload_same_content(self):
+        self.upload(self.user_content)
+        response = self.upload(self.user_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(os.listdir(self.upload_folder), [self.user_file])
+
+    def test_upload_conflict(self):
+        self.upload(self.user_content)
+        response = self.upload(b'other,content\n1,2\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(Path(self.upload_folder, self.user_file).read_bytes(), self.user_content)
+        self.assertListEqual(os.listdir(self.upload_folder), [self.user_file])
+
+    def test_upload_no_file(self):
+        response = self.client.post('/api/upload', data={'other': 'value'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_analyze(self):
+        self.upload(self.user_content)
+        with mock.patch.object(self.pool, 'submit', wraps=self.pool.submit) as submit:
+            response = self.analyze()
+            # second time analysis is taken from database
+            self.analyze()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(submit.call_count, 1)
+
+        stats = response.json()['stats']
+        self.assertIsNotNone(self.database.get_analysis(stats['hash']))
+        self.assertIn('7_2009', stats['benford'])
+        self.assertIn('Accept', response.headers['Vary'])
+
+    def test_analyze_columnar(self):
+        self.upload(self.user_content)
+        response = self.client.post('/api/analyze', json={'filename': self.user_file, 'ext': '.tsv'},
+                                    headers={'Accept': 'application/vnd.benone.columnar+json'})
+        data = response.json()
+        self.assertIn('7_2009', data['columns'])
+        column = self.client.post('/api/column', json={'id': data['id'], 'column': '7_2009'})
+        self.assertEqual(column.json()['benford'], data['benford'][data['columns'].index('7_2009')])
+
+    def test_analyze_columnar_removed_file(self):
+        # strict analysis of file removed by retention has id different from file hash
+        self.upload(self.user_content)
+        strict_analysis = DigitCounterAnalysis(f'{self.upload_folder}/{self.user_file}', ext='.tsv', recover=False)
+        self.database.add_analysis(strict_analysis)
+        self.database.link_upload(self.user_file, strict_analysis.id)
+        Path(self.upload_folder, self.user_file).unlink()
+
+        response = self.client.post('/api/analyze', json={'filename': self.user_file, 'ext': '.tsv'},
+                                    headers={'Accept': 'application/vnd.benone.columnar+json'})
+        data = response.json()
+        self.assertEqual(data['id'], strict_analysis.id)
+        column = self.client.post('/api/column', json={'id': data['id'], 'column': '7_2009'})
+        self.assertEqual(column.status_code, 200)
+
+    def test_analyze_race(self):
+        self.upload(self.user_content)
+        stored_analysis = DigitCounterAnalysis(f'{self.upload_folder}/{self.user_file}', ext='.tsv')
+        self.database.add_analysis(stored_analysis)
+
+        # analysis not found at first, stored by other request in the meantime
+        with mock.patch.object(self.database, 'get_analysis', side_effect=[None, stored_analysis]):
+            response = self.analyze()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stats']['hash'], stored_analysis.id)
+        self.assertIs(self.database.get_analysis(stored_analysis.id), stored_analysis)
+
+    def test_analyze_not_existing(self):
+        response = self.analyze()
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src.bulk import BulkAnalysis, WrongFormat
+from src.database import Database
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self) -> None:
+        # when running from base directory need to add 'tests/' prefix
+        self.test_root_dir = '' if os.getcwd().endswith('tests') else 'tests/'
+
+        self.data_folder = f'{self.test_root_dir}data'
+        self.users_db_file = f'{self.data_folder}/users.pickle'
+        self.analyses_db_file = f'{self.data_folder}/analyses.pickle'
+        self.uploads_db_file = f'{self.data_folder}/uploads.pickle'
+        self.upload_folder = f'{self.data_folder}/users_files'
+        self.user_file = 'simple_data.tsv'
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        Path(self.users_db_file).unlink(missing_ok=True)
+        Path(self.analyses_db_file).unlink(missing_ok=True)
+        Path(self.uploads_db_file).unlink(missing_ok=True)
+        self.output_dir.cleanup()
+
+    def test_collect_files(self):
+        files = BulkAnalysis.collect_files([self.upload_folder, f'{self.upload_folder}/*.tsv'])
+        self.assertListEqual([file.name for file in files], [self.user_file])
+
+    def test_wrong_format(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        with self.assertRaises(WrongFormat):
+            BulkAnalysis(db, self.output_dir.name, fmt='xml')
+
+    def test_run(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        report = BulkAnalysis(db, self.output_dir.name, workers=1).run([self.upload_folder])
+        file_report = report['files'][0]
+        self.assertFalse(file_report['reused'])
+        self.assertIsNotNone(db.get_analysis(file_report['hash']))
+        with open(file_report['summary']) as f:
+            self.assertEqual(json.load(f)['stats']['hash'], file_report['hash'])
+        self.assertTrue((Path(self.output_dir.name) / 'report.json').exists())
+
+    def test_run_reused(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        BulkAnalysis(db, self.output_dir.name, workers=1).run([self.upload_folder])
+        report = BulkAnalysis(db, self.output_dir.name, fmt='csv', workers=1).run([self.upload_folder])
+        self.assertTrue(report['files'][0]['reused'])
+        self.assertTrue((Path(self.output_dir.name) / 'report.csv').exists())
+
+    def test_run_unreadable(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        # directory exists but can not be read as file
+        unreadable = Path(self.output_dir.name) / 'unreadable.tsv'
+        unreadable.mkdir()
+        files = [Path(self.upload_folder) / self.user_file, unreadable]
+        with mock.patch.object(BulkAnalysis, 'collect_files', return_value=files):
+            report = BulkAnalysis(db, f'{self.output_dir.name}/out', workers=1).run([self.upload_folder])
+        self.assertEqual(len(report['files']), 1)
+        self.assertListEqual(list(report['errors']), [str(unreadable)])
+        self.assertTrue((Path(self.output_dir.name) / 'out' / 'report.json').exists())
+
+    def test_run_empty_file(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        empty = Path(self.output_dir.name) / 'empty.tsv'
+        empty.touch()
+        report = BulkAnalysis(db, f'{self.output_dir.name}/out', workers=1).run([str(empty)])
+        self.assertListEqual(report['files'], [])
+        self.assertEqual(report['errors'][str(empty)], f'File {empty} is empty')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
+import copy
 import os
 import unittest
 from pathlib import Path
+from threading import Thread
+from unittest import mock
 
 from src.analysis import DigitCounterAnalysis
-from src.database import Database, AnalysisExists
+from src.database import Database, AnalysisExists, AnalysisNotFound
 
 
 class TestDatabase(unittest.TestCase):
@@ -14,6 +17,7 @@ class TestDatabase(unittest.TestCase):
         self.data_folder = f'{self.test_root_dir}data'
         self.users_db_file = f'{self.data_folder}/users.pickle'
         self.analyses_db_file = f'{self.data_folder}/analyses.pickle'
+        self.uploads_db_file = f'{self.data_folder}/uploads.pickle'
         self.upload_folder = f'{self.data_folder}/users_files'
         self.user_file = 'simple_data.tsv'
         self.user_filepath = f'{self.upload_folder}/{self.user_file}'
@@ -21,11 +25,13 @@ class TestDatabase(unittest.TestCase):
     def tearDown(self) -> None:
         Path(self.users_db_file).unlink(missing_ok=True)
         Path(self.analyses_db_file).unlink(missing_ok=True)
+        Path(self.uploads_db_file).unlink(missing_ok=True)
 
     def test_init(self):
         Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
         self.assertTrue(Path(self.users_db_file).exists())
         self.assertTrue(Path(self.analyses_db_file).exists())
+        self.assertTrue(Path(self.uploads_db_file).exists())
 
     def test_get_files(self):
         db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
@@ -44,6 +50,144 @@ class TestDatabase(unittest.TestCase):
         with self.assertRaises(AnalysisExists):
             db.add_analysis(analysis)
 
+    def test_add_analysis_threads(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+
+        def add_analyses(thread_idx: int):
+            for i in range(20):
+                thread_analysis = copy.copy(analysis)
+                thread_analysis.id = f'{analysis.id}:{thread_idx}:{i}'
+                db.add_analysis(thread_analysis)
+                db.save()
+
+        threads = [Thread(target=add_analyses, args=(thread_idx,)) for thread_idx in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.assertEqual(len(db.get_analyses()), 80)
+
+    def test_store_failed(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        other_analysis = copy.copy(analysis)
+        other_analysis.id = 'other_id'
+        with mock.patch('src.database.pickle.dump', side_effect=OSError('No space left on device')):
+            with self.assertRaises(OSError):
+                db.add_analysis(other_analysis)
+
+        # previously stored database is not truncated and temporary file is removed
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.assertEqual(db.get_analysis(analysis.id).id, analysis.id)
+        self.assertListEqual([file.name for file in Path(self.data_folder).glob('.analyses.pickle-*')], [])
+
+    def test_find_analyses(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        self.assertListEqual(db.find_analyses('*.tsv'), [analysis])
+        self.assertListEqual(db.find_analyses('*.csv'), [])
+        self.assertListEqual(db.find_analyses('*', '.csv'), [])
+
+    def test_find_analyses_not_windowed(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        windowed_analysis = DigitCounterAnalysis(self.user_filepath, window_size=2)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        db.add_analysis(windowed_analysis)
+        self.assertListEqual(db.find_analyses('*'), [analysis])
+
+        # digits counted only once in aggregate by pattern
+        aggregate = db.get_aggregate(a.id for a in db.find_analyses('*'))
+        self.assertEqual(aggregate.get_stats()['files'], 1)
+        self.assertEqual(aggregate.get_counters('lead'), analysis.get_counters('lead'))
+
+    def test_link_upload(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        db.link_upload(f'{self.upload_folder}/other_data.tsv', analysis.id)
+        self.assertDictEqual(db.get_upload_links(), {'other_data.tsv': [analysis.id]})
+        # links are stored
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.assertEqual(db.get_removed_file_analysis('other_data.tsv').id, analysis.id)
+
+    def test_link_existing_analyses(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        # analyses stored before uploads database existed are linked by their filenames
+        Path(self.uploads_db_file).unlink()
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.assertDictEqual(db.get_upload_links(), {self.user_file: [analysis.id]})
+
+    def test_migrate_analyses(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        db.link_upload(self.user_file, analysis.id)
+
+        # analysis stored before lines recovery
+        del analysis.get_stats()['recovered_lines']
+        db.save()
+
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        strict_id = f'{analysis.id}:strict'
+        self.assertIsNone(db.get_analysis(analysis.id))
+        self.assertEqual(db.get_analysis(strict_id).id, strict_id)
+        self.assertDictEqual(db.get_upload_links(), {self.user_file: [strict_id]})
+        self.assertListEqual([a.id for a in db.find_analyses('*')], [strict_id])
+
+        # file analyzed again with recovery, only new analysis is aggregated by pattern
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db.add_analysis(analysis)
+        self.assertListEqual(db.find_analyses('*'), [analysis])
+        aggregate = db.get_aggregate(a.id for a in db.find_analyses('*'))
+        self.assertEqual(aggregate.get_stats()['files'], 1)
+
+    def test_get_aggregate(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        aggregate = db.get_aggregate([analysis.id])
+        self.assertEqual(aggregate.get_stats()['benford'], analysis.get_stats()['benford'])
+        # cached by set of ids
+        self.assertIs(aggregate, db.get_aggregate([analysis.id, analysis.id]))
+
+    def test_get_aggregate_cache_size(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        other_analysis = copy.copy(analysis)
+        other_analysis.id = 'other_id'
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analyses([analysis, other_analysis])
+        with mock.patch.object(Database, 'max_cached_aggregates', 2):
+            aggregate = db.get_aggregate([analysis.id])
+            other_aggregate = db.get_aggregate([other_analysis.id])
+            # used recently, so kept when next aggregate is cached
+            db.get_analysis_or_aggregate(aggregate.id)
+            db.get_aggregate([analysis.id, other_analysis.id])
+
+        self.assertIs(db.get_analysis_or_aggregate(aggregate.id), aggregate)
+        self.assertIsNone(db.get_analysis_or_aggregate(other_aggregate.id))
+        self.assertIsNot(db.get_aggregate([other_analysis.id]), other_aggregate)
+
+    def test_get_analysis_or_aggregate(self):
+        analysis = DigitCounterAnalysis(self.user_filepath)
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        db.add_analysis(analysis)
+        aggregate = db.get_aggregate([analysis.id])
+        self.assertIs(db.get_analysis_or_aggregate(analysis.id), analysis)
+        self.assertIs(db.get_analysis_or_aggregate(aggregate.id), aggregate)
+        self.assertIsNone(db.get_analysis_or_aggregate('wrong_id'))
+
+    def test_get_aggregate_not_found(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        with self.assertRaises(AnalysisNotFound):
+            db.get_aggregate(['wrong_id'])
+
 
 if __name__ == '__main__':
     unittest.main()
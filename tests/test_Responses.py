@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+import unittest
+from unittest import mock
+
+from src.analysis import DigitCounterAnalysis
+from src.responses import Compression, Layout, WrongLayout, COLUMNAR_MIMETYPE, JSON_MIMETYPE, MSGPACK_MIMETYPE
+
+
+class TestResponses(unittest.TestCase):
+    def setUp(self) -> None:
+        # when running from base directory need to add 'tests/' prefix
+        self.test_root_dir = '' if os.getcwd().endswith('tests') else 'tests/'
+
+        self.filename = f'{self.test_root_dir}data/users_files/simple_data.tsv'
+
+    def test_columnar(self):
+        analysis = DigitCounterAnalysis(self.filename)
+        stats = analysis.get_stats()
+        frequenters = analysis.get_frequenters('lead')
+        columnar = Layout.columnar(stats, frequenters)
+        self.assertListEqual(columnar['columns'], list(frequenters))
+        self.assertListEqual(columnar['benford'], [stats['benford'][column] for column in frequenters])
+        self.assertNotIn('benford', columnar['stats'])
+        self.assertNotIn('lead_frequenters', columnar)
+
+    def test_columnar_detail(self):
+        analysis = DigitCounterAnalysis(self.filename)
+        frequenters = analysis.get_frequenters('lead')
+        columnar = Layout.columnar(analysis.get_stats(), frequenters, detail=True)
+        column_idx = columnar['columns'].index('7_2009')
+        self.assertListEqual(columnar['lead_frequenters'][column_idx],
+                             [frequenters['7_2009'][digit] for digit in columnar['digits']])
+
+    def test_serialize(self):
+        data = {'columns': ['a'], 'benford': [0.5]}
+        self.assertEqual(json.loads(Layout.serialize(data, COLUMNAR_MIMETYPE)), data)
+        self.assertEqual(json.loads(Layout.serialize(data, JSON_MIMETYPE)), data)
+        with self.assertRaises(WrongLayout):
+            Layout.serialize(data, 'text/xml')
+
+    def test_compress(self):
+        body = b'{"benford":[0.5]}' * 100
+        self.assertTrue(Compression.should_compress(body, 'gzip'))
+        self.assertFalse(Compression.should_compress(body[:10], 'gzip'))
+        self.assertFalse(Compression.should_compress(body, None))
+        self.assertEqual(gzip.decompress(Compression.compress(body, 'gzip')), body)
+
+    def test_optional_dependencies(self):
+        # not installed dependencies are not imported again on each request
+        with mock.patch('src.responses.msgpack', None), mock.patch('src.responses.brotli', None), \
+                mock.patch('builtins.__import__') as import_mock:
+            self.assertNotIn(MSGPACK_MIMETYPE, Layout.get_supported_mimetypes())
+            self.assertListEqual(Compression.get_supported_encodings(), ['gzip'])
+            with self.assertRaises(WrongLayout):
+                Layout.serialize({}, MSGPACK_MIMETYPE)
+        import_mock.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src.analysis import DigitCounterAnalysis, WrongFile
+from src.database import Database
+from src.retention import Retention
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self) -> None:
+        # when running from base directory need to add 'tests/' prefix
+        self.test_root_dir = '' if os.getcwd().endswith('tests') else 'tests/'
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_folder = self.tmp_dir.name
+        self.users_db_file = f'{self.data_folder}/users.pickle'
+        self.analyses_db_file = f'{self.data_folder}/analyses.pickle'
+        self.upload_folder = f'{self.data_folder}/users_files'
+        self.user_file = 'simple_data.tsv'
+        self.old_user_file = 'old_data.tsv'
+
+        # two files, one of them not used for an hour
+        Path(self.upload_folder).mkdir()
+        source = f'{self.test_root_dir}data/users_files/{self.user_file}'
+        shutil.copy(source, f'{self.upload_folder}/{self.user_file}')
+        shutil.copy(source, f'{self.upload_folder}/{self.old_user_file}')
+        hour_ago = time.time() - 3600
+        os.utime(f'{self.upload_folder}/{self.old_user_file}', (hour_ago, hour_ago))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_uploads_order(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        uploads = Retention(db).get_uploads()
+        self.assertListEqual([upload.path.name for upload in uploads], [self.old_user_file, self.user_file])
+
+    def test_no_quotas(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.assertListEqual(Retention(db).evict(), [])
+
+    def analyze(self, db: Database, user_file: str) -> DigitCounterAnalysis:
+        analysis = DigitCounterAnalysis(f'{self.upload_folder}/{user_file}')
+        if not db.get_analysis(analysis.id):
+            db.add_analysis(analysis)
+        db.link_upload(user_file, analysis.id)
+        return analysis
+
+    def test_evict_age(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.analyze(db, self.old_user_file)
+        retention = Retention(db, max_age=1800)
+        self.assertListEqual(retention.evict(), [self.old_user_file])
+        self.assertListEqual(db.get_filenames(), [self.user_file])
+
+    def test_evict_size(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.analyze(db, self.old_user_file)
+        self.analyze(db, self.user_file)
+        size = Path(self.upload_folder, self.user_file).stat().st_size
+        retention = Retention(db, max_size=size)
+        self.assertListEqual(retention.evict(), [self.old_user_file])
+        # recently used file is never removed
+        self.assertListEqual(Retention(db, max_size=1).evict(), [])
+
+    def test_evict_not_analyzed(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        # nothing would be kept of file never analyzed, so it is only reported
+        report = Retention(db, max_age=1800, max_size=1).compact()
+        self.assertListEqual(report['evicted'], [])
+        self.assertListEqual(report['files'], [self.old_user_file, self.user_file])
+        self.assertTrue(Path(self.upload_folder, self.old_user_file).exists())
+
+    def test_analysis_kept(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        analysis = self.analyze(db, self.old_user_file)
+        self.assertListEqual(Retention(db).get_orphans()['files'], [self.user_file])
+
+        report = Retention(db, max_age=1800).compact()
+        self.assertListEqual(report['evicted'], [self.old_user_file])
+        self.assertListEqual(report['analyses'], [analysis.id])
+        self.assertEqual(db.get_removed_file_analysis(self.old_user_file), analysis)
+        with self.assertRaises(WrongFile):
+            db.get_removed_file_analysis(self.user_file)
+
+    def test_same_content_files(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        analysis = DigitCounterAnalysis(f'{self.upload_folder}/{self.user_file}')
+        db.add_analysis(analysis)
+        # old file has the same content, so its analysis is the same
+        db.link_upload(self.user_file, analysis.id)
+        db.link_upload(self.old_user_file, analysis.id)
+        self.assertDictEqual(Retention(db).get_orphans(), {'files': [], 'analyses': []})
+
+        Retention(db, max_age=1800).compact()
+        self.assertEqual(db.get_removed_file_analysis(self.old_user_file), analysis)
+
+    def test_remove_partial_uploads(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        stale_upload = Path(self.upload_folder, f'{Database.partial_upload_prefix}stale')
+        current_upload = Path(self.upload_folder, f'{Database.partial_upload_prefix}current')
+        stale_upload.write_bytes(b'1,2\n')
+        current_upload.write_bytes(b'1,2\n')
+        hour_ago = time.time() - 3600
+        os.utime(stale_upload, (hour_ago, hour_ago))
+
+        # removed even if no quotas set, upload still being written is kept
+        report = Retention(db).compact()
+        self.assertListEqual(report['partial'], [stale_upload.name])
+        self.assertFalse(stale_upload.exists())
+        self.assertTrue(current_upload.exists())
+
+    def test_compact_does_not_store(self):
+        db = Database(self.users_db_file, self.analyses_db_file, self.upload_folder)
+        self.analyze(db, self.old_user_file)
+        with mock.patch.object(db, 'save') as save:
+            Retention(db, max_age=1800).compact()
+        save.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()